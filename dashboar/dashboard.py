@@ -1,4 +1,19 @@
 import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import functools
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:
+    # sem fcntl (windows) nao ha trava entre processos na publicacao do dataset
+    fcntl = None
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -7,18 +22,133 @@ import dash
 from dash import dcc, html, Input, Output, State, callback_context as ctx
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 
-data_path = "datasus_limpo.parquet"
+# modulos da raiz do repositorio, compartilhados com o migracao_db.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recorte_parquet import filtros_parquet
 
-def safe_load_parquet(path):
+# arquivo parquet ou diretorio particionado (hive, ver particionar_parquet.py)
+data_path = os.getenv('DASHBOARD_DADOS', "datasus_limpo.parquet")
+
+# recorte opcional do dataset (ex.: um deploy por estado ou por periodo): vira
+# filtro na leitura, e com o dataset particionado por ano_mes/estado so os
+# diretorios e row groups do recorte sao lidos
+RECORTE = {
+    'inicio': os.getenv('DASHBOARD_RECORTE_INICIO', ''),
+    'fim': os.getenv('DASHBOARD_RECORTE_FIM', ''),
+    'municipios': [m.strip() for m in os.getenv('DASHBOARD_RECORTE_MUNICIPIOS', '').split(',') if m.strip()],
+    'estados': [e.strip() for e in os.getenv('DASHBOARD_RECORTE_ESTADOS', '').split(',') if e.strip()],
+}
+
+# marcadores de valor ausente nas dimensoes do cubo de contagens
+DIA_SEM_DATA = np.iinfo(np.int32).max
+IDADE_SEM_VALOR = np.iinfo(np.int16).min
+
+# bits (msb primeiro, como np.packbits) de cada valor de byte
+TABELA_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.int64)
+
+# colunas do parquet usadas por cada grafico; so elas sao lidas na carga e
+# colunas novas pedidas depois sao carregadas sob demanda
+COLUNAS_GRAFICOS = {
+    'filtros': ['dataNotificacao', 'municipio'],
+    'metricas': ['classificacaoFinal', 'municipio'],
+    'serie-temporal': ['dataNotificacao', 'classificacaoFinal'],
+    'dist-sex': ['sexo'],
+    'dist-idade': ['idade'],
+    'casos-sex': ['sexo'],
+    'casos-idade': ['idade'],
+    'secao-sintomas': ['sintomas'],
+    'map-notificacoes': ['latitude', 'longitude', 'municipio'],
+}
+
+# arquivo ao lado do parquet com o dataset ja preprocessado e os indices;
+# vazio desativa. mudar VERSAO_CACHE_DISCO invalida caches de versoes antigas
+CAMINHO_CACHE_DISCO = os.getenv('DASHBOARD_CACHE_DISCO', data_path.rstrip('/\\') + '.cache.pkl')
+VERSAO_CACHE_DISCO = 5
+
+# mapa: pontos agregados numa grade no servidor (uma celula por raio do
+# mapa de densidade no zoom atual) em vez de enviar cada notificacao
+MAPA_AGREGADO = os.getenv('DASHBOARD_MAPA_AGREGADO', '1') != '0'
+MAPA_RAIO = 10
+MAPA_CENTRO = dict(lat=-1.4558, lon=-48.5044)
+MAPA_ZOOM = 5
+
+# granularidades da serie temporal; todas saem da mesma serie diaria
+GRANULARIDADES_SERIE = [
+    {'label': 'dia', 'value': 'dia'},
+    {'label': 'semana', 'value': 'semana'},
+    {'label': 'semana epidemiologica', 'value': 'semana_epi'},
+    {'label': 'mes', 'value': 'mes'},
+]
+GRANULARIDADE_PADRAO = 'mes'
+JANELA_MEDIA_MOVEL = 7
+
+# numero maximo de barras do histograma de idades
+HISTOGRAMA_IDADE_FAIXAS = 40
+
+# diretorio onde as colunas preprocessadas e os indices sao gravados uma vez
+# como arquivos .npy e mapeados (somente leitura) por todos os workers; vazio
+# desativa e cada processo mantem sua propria copia. o dashboard so escreve
+# (e apaga) dentro do subdiretorio SUBDIR_MEMORIA_COMPARTILHADA. a recarga
+# incremental e as colunas carregadas sob demanda (garantir_colunas) criam um
+# df novo, entao a partir dai o worker passa a ter uma copia propria
+DIR_MEMORIA_COMPARTILHADA = os.getenv('DASHBOARD_MEMORIA_COMPARTILHADA', '')
+SUBDIR_MEMORIA_COMPARTILHADA = 'datasus_dashboard'
+
+# backend das consultas dos graficos: 'pandas' (dataset e indices em memoria),
+# 'arrow' (consultas direto no parquet com pyarrow.dataset/compute) ou
+# 'postgres' (agregacoes no banco gerado por migracao_db.py)
+BACKEND = os.getenv('DASHBOARD_BACKEND', 'pandas')
+
+# conexao do backend postgres: mesmas variaveis de ambiente do migracao_db.py
+DB_CONFIG = {
+    'host': os.getenv('PG_HOST'),
+    'database': os.getenv('PG_DB'),
+    'user': os.getenv('PG_USER'),
+    'password': os.getenv('PG_PASSWORD'),
+    'port': int(os.getenv('PG_PORT', '5432')),
+}
+POOL_MIN_CONEXOES = int(os.getenv('DASHBOARD_PG_POOL_MIN', '1'))
+POOL_MAX_CONEXOES = int(os.getenv('DASHBOARD_PG_POOL_MAX', '8'))
+
+# diretorio vigiado: parquets novos (ou row groups acrescentados) sao anexados
+# ao dataset em memoria sem reiniciar; vazio desativa
+DIR_DADOS = os.getenv('DASHBOARD_DIR_DADOS', '')
+INTERVALO_RECARGA = float(os.getenv('DASHBOARD_INTERVALO_RECARGA', '60'))
+
+# limites do cache de filtros compartilhado entre os callbacks
+CACHE_FILTROS_MAX_ITENS = int(os.getenv('DASHBOARD_CACHE_FILTROS_ITENS', '32'))
+CACHE_FILTROS_MAX_MB = float(os.getenv('DASHBOARD_CACHE_FILTROS_MB', '512'))
+
+# limites do cache de figuras ja serializadas
+CACHE_FIGURAS_MAX_ITENS = int(os.getenv('DASHBOARD_CACHE_FIGURAS_ITENS', '256'))
+CACHE_FIGURAS_MAX_MB = float(os.getenv('DASHBOARD_CACHE_FIGURAS_MB', '64'))
+
+def safe_load_parquet(path, columns=None, filters=None):
     try:
-        df = pd.read_parquet(path)
+        if os.path.isdir(path):
+            # dataset particionado: as colunas de particao voltam como texto (o
+            # read_parquet as traz como dicionario e falha se alguma particao e nula)
+            import pyarrow.dataset as ds
+            import pyarrow.parquet as pq
+            dataset = ds.dataset(path, format='parquet', partitioning='hive')
+            filtro = pq.filters_to_expression(filters) if filters else None
+            df = dataset.to_table(columns=columns, filter=filtro).to_pandas()
+        else:
+            df = pd.read_parquet(path, columns=columns, filters=filters)
     except Exception as e:
         raise RuntimeError(
             f"falha ao carregar parquet: {e}. certifique-se de ter 'pyarrow' ou 'fastparquet' instalados (pip install pyarrow)."
         )
     return df
 
+# colunas criadas por preprocess_data (nao existem nos arquivos)
+COLUNAS_DERIVADAS = ['ano_mes', 'ano_semana', 'positivo']
+
+CLASSIFICACOES_CONFIRMADAS = ['CONFIRMADO LABORATORIAL', 'CONFIRMADO POR CRITÉRIO CLÍNICO',
+                              'CONFIRMADO CLÍNICO-EPIDEMIOLÓGICO', 'CONFIRMADO CLÍNICO-IMAGEM']
+
 def preprocess_data(df):
     if 'dataNotificacao' in df.columns:
         df['dataNotificacao'] = pd.to_datetime(df['dataNotificacao'], errors='coerce')
@@ -28,21 +158,452 @@ def preprocess_data(df):
         df['ano_semana'] = df['dataNotificacao'].dt.to_period('W').astype(str)
     
     if 'classificacaoFinal' in df.columns:
-        confirmados = ['CONFIRMADO LABORATORIAL', 'CONFIRMADO POR CRITÉRIO CLÍNICO', 
-                       'CONFIRMADO CLÍNICO-EPIDEMIOLÓGICO', 'CONFIRMADO CLÍNICO-IMAGEM']
-        df['positivo'] = df['classificacaoFinal'].isin(confirmados).astype(int)
+        df['positivo'] = df['classificacaoFinal'].isin(CLASSIFICACOES_CONFIRMADAS).astype(int)
+    
+    # ordenar uma vez por data permite filtrar periodos por busca binaria; o
+    # indice guarda a posicao original da linha no arquivo
+    if 'dataNotificacao' in df.columns:
+        df = df.sort_values('dataNotificacao', kind='stable', na_position='last')
     
     return df
 
+def otimizar_tipos(df, limite_categoria=0.5):
+    # textos repetitivos viram category, codigos numericos viram inteiros
+    # anulaveis do menor tamanho possivel e idade vira UInt8
+    for coluna in df.columns:
+        serie = df[coluna]
+        if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_datetime64_any_dtype(serie):
+            continue
+        if pd.api.types.is_numeric_dtype(serie):
+            df[coluna] = reduzir_numerico(serie, coluna)
+            continue
+        validos = serie.dropna()
+        if len(validos) > 0 and validos.map(type).eq(bool).all():
+            df[coluna] = serie.astype('boolean')
+        elif not isinstance(serie.dtype, pd.CategoricalDtype) and serie.nunique(dropna=True) <= limite_categoria * max(len(serie), 1):
+            df[coluna] = serie.astype('category')
+    return df
+
+def reduzir_numerico(serie, coluna):
+    validos = serie.dropna()
+    if len(validos) == 0 or not np.all(np.mod(validos.to_numpy(dtype='float64'), 1) == 0):
+        return serie
+    minimo, maximo = validos.min(), validos.max()
+    if coluna == 'idade' and minimo >= 0 and maximo <= np.iinfo(np.uint8).max:
+        return serie.astype('UInt8')
+    if coluna == 'positivo' and not serie.isna().any():
+        return serie.astype(np.int8)
+    for tipo in ['Int8', 'Int16', 'Int32']:
+        info = np.iinfo(tipo.lower())
+        if minimo >= info.min and maximo <= info.max:
+            return serie.astype(tipo)
+    return serie
+
+def memoria_mb(df):
+    return df.memory_usage(index=True, deep=True).sum() / (1024 * 1024)
+
+def construir_indices(df):
+    indices = {}
+    if 'dataNotificacao' in df.columns:
+        datas = df['dataNotificacao'].to_numpy()
+        # datas nulas ficam no fim apos a ordenacao e nunca entram num filtro de periodo
+        indices['datas'] = datas[:int(df['dataNotificacao'].notna().sum())]
+    codigos_municipio = None
+    if 'municipio' in df.columns:
+        codigos, nomes = pd.factorize(df['municipio'])
+        indices['municipios'] = indice_municipios(codigos, np.asarray(nomes, dtype=object))
+        codigos_municipio = codigos
+    if not df.empty:
+        indices['cubo'] = construir_cubo(df, codigos_municipio)
+        indices['acumulados'] = construir_acumulados(indices['cubo'])
+    if 'sintomas' in df.columns:
+        indices['sintomas'] = construir_matriz_sintomas(df['sintomas'])
+    return indices
+
+def indice_municipios(codigos, nomes):
+    # indice invertido: linhas[limites[c]:limites[c + 1]] sao as linhas (em
+    # ordem crescente) do municipio de codigo c
+    ordem = np.argsort(codigos, kind='stable')
+    return {
+        'codigo': {str(nome): i for i, nome in enumerate(nomes)},
+        'linhas': ordem,
+        'limites': np.searchsorted(codigos[ordem], np.arange(len(nomes) + 1)),
+        'nomes': nomes,
+    }
+
+def construir_matriz_sintomas(sintomas):
+    # cada linha vira um conjunto de bits (um por sintoma distinto); o texto e
+    # separado uma unica vez por valor distinto da coluna, nao por linha
+    codigos, valores = pd.factorize(sintomas)
+    nomes = []
+    posicao = {}
+    presentes = []
+    for sintomas_str in valores:
+        lista = []
+        for sintoma in separar_sintomas(sintomas_str):
+            if sintoma not in posicao:
+                posicao[sintoma] = len(nomes)
+                nomes.append(sintoma)
+            lista.append(posicao[sintoma])
+        presentes.append(lista)
+
+    flags = np.zeros((len(valores) + 1, max(len(nomes), 1)), dtype=bool)
+    for i, lista in enumerate(presentes):
+        flags[i, lista] = True
+    # a ultima linha (sem nenhum bit) representa sintomas nulos (codigo -1)
+    bits_por_valor = np.packbits(flags, axis=1)
+    return {'nomes': np.asarray(nomes, dtype=object), 'bits': bits_por_valor[codigos]}
+
+def separar_sintomas(sintomas_str):
+    # sintomas distintos de um valor da coluna (texto separado por virgulas)
+    sintomas_str = str(sintomas_str).strip()
+    if not sintomas_str or sintomas_str.upper() == 'NÃO INFORMADO':
+        return []
+    return list(dict.fromkeys(s.strip() for s in sintomas_str.split(',') if s.strip()))
+
+def contar_sintomas(linhas):
+    # contagem por sintoma nas linhas selecionadas: histograma de cada byte da
+    # matriz seguido de uma multiplicacao pela tabela de bits dos 256 valores
+    matriz = indices['sintomas']
+    bits = matriz['bits'][linhas]
+    contagem = np.zeros(bits.shape[1] * 8, dtype=np.int64)
+    for j in range(bits.shape[1]):
+        histograma = np.bincount(bits[:, j], minlength=256)
+        contagem[j * 8:(j + 1) * 8] = histograma @ TABELA_BITS
+    return pd.Series(contagem[:len(matriz['nomes'])], index=matriz['nomes'])
+
+def construir_cubo(df, codigos_municipio):
+    # cubo esparso de contagens por (dia, municipio, sexo, idade, positivo): os
+    # graficos de contagem somam celulas, e o custo depende do numero de
+    # combinacoes distintas e nao do numero de notificacoes
+    n = len(df)
+    if 'dataNotificacao' in df.columns:
+        dias = df['dataNotificacao'].to_numpy().astype('datetime64[D]').astype(np.int64)
+        dias[df['dataNotificacao'].isna().to_numpy()] = DIA_SEM_DATA
+    else:
+        dias = np.full(n, DIA_SEM_DATA, dtype=np.int64)
+    sexos = pd.Index([])
+    if 'sexo' in df.columns:
+        codigos_sexo, sexos = pd.factorize(df['sexo'])
+    else:
+        codigos_sexo = np.full(n, -1)
+    if 'idade' in df.columns:
+        # idade em anos completos
+        idades = df['idade'].astype('float64').fillna(IDADE_SEM_VALOR).to_numpy().astype(np.int16)
+    else:
+        idades = np.full(n, IDADE_SEM_VALOR, dtype=np.int16)
+
+    celulas = pd.DataFrame({
+        'dia': dias,
+        'municipio': codigos_municipio if codigos_municipio is not None else np.full(n, -1),
+        'sexo': codigos_sexo,
+        'idade': idades,
+        'positivo': df['positivo'].to_numpy() if 'positivo' in df.columns else np.zeros(n, dtype=int),
+    }).groupby(['dia', 'municipio', 'sexo', 'idade', 'positivo']).size().reset_index(name='n')
+
+    cubo = {coluna: celulas[coluna].to_numpy() for coluna in celulas.columns}
+    cubo['sexos'] = np.asarray(sexos, dtype=object)
+    return cubo
+
+def construir_acumulados(cubo):
+    # somas prefixadas por dia, no total e por municipio: o total de qualquer
+    # periodo e a diferenca entre duas posicoes, sem percorrer as celulas
+    dias, posicao_dia = np.unique(cubo['dia'], return_inverse=True)
+    confirmados = cubo['n'] * cubo['positivo']
+    por_dia = np.bincount(posicao_dia, weights=cubo['n'], minlength=len(dias))
+    confirmados_dia = np.bincount(posicao_dia, weights=confirmados, minlength=len(dias))
+
+    # chave (municipio + 1, dia) achatada num inteiro ordenado; o codigo -1
+    # (sem municipio) vira o bloco 0
+    chaves, posicao_chave = np.unique((cubo['municipio'].astype(np.int64) + 1) * (len(dias) + 1) + posicao_dia,
+                                      return_inverse=True)
+    por_chave = np.bincount(posicao_chave, weights=cubo['n'], minlength=len(chaves))
+    confirmados_chave = np.bincount(posicao_chave, weights=confirmados, minlength=len(chaves))
+    return {
+        'dias': dias,
+        'total': np.concatenate([[0], np.cumsum(por_dia)]).astype(np.int64),
+        'confirmados': np.concatenate([[0], np.cumsum(confirmados_dia)]).astype(np.int64),
+        'chaves': chaves,
+        'total_chave': np.concatenate([[0], np.cumsum(por_chave)]).astype(np.int64),
+        'confirmados_chave': np.concatenate([[0], np.cumsum(confirmados_chave)]).astype(np.int64),
+    }
+
+def colunas_do_arquivo(path):
+    # le apenas o schema (de um arquivo ou de um diretorio particionado, com as
+    # colunas de particao); sem pyarrow nao ha como projetar e o arquivo e lido inteiro
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        return None
+    return ds.dataset(path, format='parquet', partitioning='hive').schema.names
+
+def filtros_recorte(colunas_arquivo, recorte=RECORTE):
+    # mesmos filtros de leitura do migracao_db.py (recorte_parquet.py)
+    return filtros_parquet(colunas_arquivo, recorte['inicio'], recorte['fim'],
+                           recorte['municipios'], recorte['estados'])
+
+def filtrar_recorte(parte, filtros):
+    # mesmo recorte aplicado em memoria, para leituras sem pushdown
+    mascara = np.ones(len(parte), dtype=bool)
+    for coluna, operador, valor in filtros or []:
+        if coluna not in parte.columns:
+            continue
+        serie = parte[coluna]
+        if operador == 'in':
+            condicao = serie.isin(valor)
+        elif operador == '>=':
+            condicao = serie >= valor
+        elif operador == '<=':
+            condicao = serie <= valor
+        else:
+            condicao = serie < valor
+        mascara &= condicao.fillna(False).to_numpy(dtype=bool)
+    return parte[mascara]
+
+def assinatura_dados(path):
+    # tamanho total e mtime mais recente; num diretorio, de todos os arquivos
+    if not os.path.isdir(path):
+        info = os.stat(path)
+        return info.st_size, info.st_mtime_ns
+    tamanho, mtime = 0, 0
+    for arquivo in arquivos_dados(path):
+        info = os.stat(arquivo)
+        tamanho += info.st_size
+        mtime = max(mtime, info.st_mtime_ns)
+    return tamanho, mtime
+
+def arquivos_dados(path):
+    if not os.path.isdir(path):
+        return [path]
+    arquivos = []
+    for raiz, _, nomes in os.walk(path):
+        arquivos += [os.path.join(raiz, nome) for nome in nomes if nome.endswith('.parquet')]
+    return sorted(arquivos)
+
+def colunas_graficos():
+    return sorted({c for colunas in COLUNAS_GRAFICOS.values() for c in colunas})
+
+def hash_arquivo(path):
+    h = hashlib.sha256()
+    for arquivo in arquivos_dados(path):
+        h.update(os.path.relpath(arquivo, path).encode())
+        with open(arquivo, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(bloco)
+    return h.hexdigest()
+
+def ler_cache_disco(caminho_cache, path, colunas):
+    # o cache vale se tamanho e mtime do parquet nao mudaram; se mudaram, o hash
+    # do conteudo decide (ex.: arquivo copiado de novo sem alteracao)
+    if not caminho_cache or not os.path.exists(caminho_cache):
+        return None
+    try:
+        cache = pd.read_pickle(caminho_cache)
+    except Exception as e:
+        print(f"cache em disco ignorado (erro ao ler: {e})")
+        return None
+    if cache.get('versao') != VERSAO_CACHE_DISCO or cache.get('colunas') != colunas or cache.get('recorte') != RECORTE:
+        return None
+    tamanho, mtime = assinatura_dados(path)
+    if (cache['tamanho'], cache['mtime']) != (tamanho, mtime):
+        if cache['tamanho'] != tamanho or cache['hash'] != hash_arquivo(path):
+            return None
+        cache['mtime'] = mtime
+        salvar_cache_disco(caminho_cache, cache)
+    return cache
+
+def salvar_cache_disco(caminho_cache, cache):
+    # escrita atomica: workers iniciando ao mesmo tempo nunca leem um arquivo pela metade
+    temporario = f"{caminho_cache}.{os.getpid()}.tmp"
+    try:
+        pd.to_pickle(cache, temporario)
+        os.replace(temporario, caminho_cache)
+    except Exception as e:
+        print(f"nao foi possivel salvar o cache em disco: {e}")
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+def carregar_dataset(path):
+    colunas_arquivo = colunas_do_arquivo(path)
+    colunas_iniciais = None
+    if colunas_arquivo is not None:
+        colunas_iniciais = [c for c in colunas_arquivo if c in colunas_graficos()]
+    df = safe_load_parquet(path, columns=colunas_iniciais, filters=filtros_recorte(colunas_arquivo))
+    print(f"dataset carregado: {len(df)} linhas")
+    print(f"colunas disponiveis: {list(df.columns)}")
+    df = preprocess_data(df)
+    memoria_antes = memoria_mb(df)
+    df = otimizar_tipos(df)
+    print(f"memoria do dataset: {memoria_antes:.1f} MB -> {memoria_mb(df):.1f} MB")
+    return df, colunas_arquivo
+
+# ============= MEMORIA COMPARTILHADA ENTRE WORKERS =============
+
+# nome dos subdiretorios de versao; so eles sao apagados na limpeza
+PADRAO_VERSAO_COMPARTILHADA = re.compile(r'^\d+-\d+-v\d+-[0-9a-f]{8}$')
+
+def nome_versao_compartilhada(path):
+    # cada versao do parquet (e do formato) ganha seu proprio subdiretorio, entao
+    # workers antigos continuam mapeando arquivos que nunca sao sobrescritos
+    tamanho, mtime = assinatura_dados(path)
+    colunas = hashlib.md5(json.dumps([colunas_graficos(), RECORTE], sort_keys=True).encode()).hexdigest()[:8]
+    return f"{tamanho}-{mtime}-v{VERSAO_CACHE_DISCO}-{colunas}"
+
+def raiz_compartilhada(diretorio):
+    return os.path.join(diretorio, SUBDIR_MEMORIA_COMPARTILHADA)
+
+def _gravar_array(diretorio, nome, array):
+    np.save(os.path.join(diretorio, nome + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+    return {'__npy__': nome}
+
+def _decompor_indices(diretorio, valor, prefixo):
+    # arrays numericos vao para .npy; o resto (nomes, dicionarios) fica no meta
+    if isinstance(valor, dict):
+        return {k: _decompor_indices(diretorio, v, f"{prefixo}.{k}") for k, v in valor.items()}
+    if isinstance(valor, np.ndarray) and valor.dtype != object:
+        return _gravar_array(diretorio, prefixo, valor)
+    return valor
+
+def _recompor_indices(diretorio, valor):
+    if isinstance(valor, dict):
+        if '__npy__' in valor:
+            return np.load(os.path.join(diretorio, valor['__npy__'] + '.npy'), mmap_mode='r')
+        return {k: _recompor_indices(diretorio, v) for k, v in valor.items()}
+    return valor
+
+def publicar_memoria_compartilhada(diretorio, path, df, indices, colunas_arquivo):
+    raiz = raiz_compartilhada(diretorio)
+    destino = os.path.join(raiz, nome_versao_compartilhada(path))
+    if os.path.exists(destino):
+        return
+    os.makedirs(raiz, exist_ok=True)
+    temporario = tempfile.mkdtemp(dir=raiz, prefix='.tmp-')
+    try:
+        colunas = {}
+        for i, coluna in enumerate(df.columns):
+            serie = df[coluna]
+            nome = f"coluna{i}"
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                colunas[coluna] = {'tipo': 'category', 'dtype': serie.dtype,
+                                   'codigos': _gravar_array(temporario, nome, serie.cat.codes.to_numpy())}
+            elif isinstance(serie.array, pd.arrays.IntegerArray) or isinstance(serie.array, pd.arrays.BooleanArray):
+                colunas[coluna] = {'tipo': 'mascarado', 'dtype': serie.dtype,
+                                   'valores': _gravar_array(temporario, nome, serie.array._data),
+                                   'mascara': _gravar_array(temporario, nome + '_mascara', serie.array._mask)}
+            elif isinstance(serie.dtype, np.dtype) and serie.dtype != object:
+                colunas[coluna] = {'tipo': 'numpy', 'valores': _gravar_array(temporario, nome, serie.to_numpy())}
+            else:
+                # textos nao categorizados nao tem representacao mapeavel
+                colunas[coluna] = {'tipo': 'objeto', 'valores': serie.to_numpy()}
+        meta = {
+            'colunas': colunas,
+            'ordem': list(df.columns),
+            'index': _gravar_array(temporario, 'index', df.index.to_numpy()),
+            'indices': _decompor_indices(temporario, indices, 'indice'),
+            'colunas_arquivo': colunas_arquivo,
+        }
+        pd.to_pickle(meta, os.path.join(temporario, 'meta.pkl'))
+        # rename atomico: se outro worker publicou primeiro, o dele vale
+        os.rename(temporario, destino)
+        print(f"dataset publicado em memoria compartilhada: {destino}")
+    except OSError:
+        shutil.rmtree(temporario, ignore_errors=True)
+        if not os.path.exists(destino):
+            raise
+    for antigo in os.listdir(raiz):
+        if antigo != os.path.basename(destino) and PADRAO_VERSAO_COMPARTILHADA.match(antigo):
+            shutil.rmtree(os.path.join(raiz, antigo), ignore_errors=True)
+
+def abrir_memoria_compartilhada(diretorio, path):
+    origem = os.path.join(raiz_compartilhada(diretorio), nome_versao_compartilhada(path))
+    if not os.path.exists(os.path.join(origem, 'meta.pkl')):
+        return None
+    meta = pd.read_pickle(os.path.join(origem, 'meta.pkl'))
+    colunas = {}
+    for coluna in meta['ordem']:
+        info = meta['colunas'][coluna]
+        if info['tipo'] == 'category':
+            codigos = _recompor_indices(origem, info['codigos'])
+            colunas[coluna] = pd.Categorical.from_codes(codigos, dtype=info['dtype'], validate=False)
+        elif info['tipo'] == 'mascarado':
+            classe = pd.arrays.BooleanArray if info['dtype'] == 'boolean' else pd.arrays.IntegerArray
+            colunas[coluna] = classe(_recompor_indices(origem, info['valores']),
+                                     _recompor_indices(origem, info['mascara']), copy=False)
+        elif info['tipo'] == 'numpy':
+            colunas[coluna] = _recompor_indices(origem, info['valores'])
+        else:
+            colunas[coluna] = info['valores']
+    index = pd.Index(_recompor_indices(origem, meta['index']), copy=False)
+    df = pd.DataFrame(colunas, index=index, copy=False)
+    return df, _recompor_indices(origem, meta['indices']), meta['colunas_arquivo']
+
+def carregar_memoria_compartilhada(diretorio, path):
+    # so um worker prepara e publica: os outros esperam a trava e, com ela,
+    # encontram a versao ja publicada e apenas mapeiam os arquivos
+    dados = abrir_memoria_compartilhada(diretorio, path)
+    if dados is not None:
+        return dados
+    raiz = raiz_compartilhada(diretorio)
+    os.makedirs(raiz, exist_ok=True)
+    with open(os.path.join(raiz, '.lock'), 'a') as trava:
+        if fcntl is not None:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+        try:
+            dados = abrir_memoria_compartilhada(diretorio, path)
+            if dados is None:
+                publicar_memoria_compartilhada(diretorio, path, *carregar_com_caches(path))
+                dados = abrir_memoria_compartilhada(diretorio, path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+    return dados
+
+def carregar_com_caches(path):
+    cache = ler_cache_disco(CAMINHO_CACHE_DISCO, path, colunas_graficos())
+    if cache is not None:
+        print(f"dataset carregado do cache em disco: {len(cache['df'])} linhas")
+        return cache['df'], cache['indices'], cache['colunas_arquivo']
+    df, colunas_arquivo = carregar_dataset(path)
+    indices = construir_indices(df)
+    if CAMINHO_CACHE_DISCO:
+        tamanho, mtime = assinatura_dados(path)
+        salvar_cache_disco(CAMINHO_CACHE_DISCO, {
+            'versao': VERSAO_CACHE_DISCO,
+            'colunas': colunas_graficos(),
+            'recorte': RECORTE,
+            'tamanho': tamanho,
+            'mtime': mtime,
+            'hash': hash_arquivo(path),
+            'df': df,
+            'indices': indices,
+            'colunas_arquivo': colunas_arquivo,
+        })
+    return df, indices, colunas_arquivo
+
 print("carregando dados em:", data_path)
-if not os.path.exists(data_path):
+colunas_arquivo = None
+if BACKEND == 'postgres' or (BACKEND == 'arrow' and os.path.exists(data_path)):
+    # esses backends consultam a fonte a cada filtro; nada e mantido em memoria
+    df = pd.DataFrame()
+    indices = {}
+elif not os.path.exists(data_path):
     print("arquivo nao encontrado localmente. coloque o arquivo no mesmo diretorio ou ajuste data_path.")
     df = pd.DataFrame()
+    indices = construir_indices(df)
+elif DIR_MEMORIA_COMPARTILHADA:
+    # todos os workers (inclusive o que publicou) usam os arquivos mapeados
+    df, indices, colunas_arquivo = carregar_memoria_compartilhada(DIR_MEMORIA_COMPARTILHADA, data_path)
+    print(f"dataset mapeado da memoria compartilhada: {len(df)} linhas")
 else:
-    df = safe_load_parquet(data_path)
-    print(f"dataset carregado: {len(df)} linhas")
-    print(f"colunas disponiveis: {list(df.columns)}")
-    df = preprocess_data(df)
+    df, indices, colunas_arquivo = carregar_com_caches(data_path)
+
+# partes do dataset na ordem dos ids de linha (o indice de df): o arquivo
+# principal e depois cada arquivo ou faixa de row groups da recarga incremental
+fontes = []
+grupos_lidos = {}
+if BACKEND not in ('arrow', 'postgres') and os.path.exists(data_path):
+    fontes.append({'caminho': data_path, 'grupos': None, 'colunas': colunas_arquivo,
+                   'filtros': filtros_recorte(colunas_arquivo), 'linhas': len(df)})
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 server = app.server
@@ -78,7 +639,9 @@ app.layout = html.Div([
     
     html.Div([
         html.Div([
-            html.Label("filtrar por municipio:", style={'fontWeight': 'bold'}),
+            # no backend postgres o filtro e pelo municipio de notificacao (ver FILTRO_BANCO)
+            html.Label("filtrar por municipio de notificacao:" if BACKEND == 'postgres' else "filtrar por municipio:",
+                       style={'fontWeight': 'bold'}),
             dcc.Dropdown(id='municipio-select', options=[], multi=True, placeholder="selecione municipios")
         ], style={'width':'45%','display':'inline-block', 'marginRight': '2%'}),
         
@@ -109,6 +672,12 @@ app.layout = html.Div([
 
     html.Div([
         html.H3("evolucao temporal", style={'color': '#2c3e50', 'textTransform': 'lowercase'}),
+        html.Div([
+            dcc.RadioItems(id='granularidade-serie', options=GRANULARIDADES_SERIE, value=GRANULARIDADE_PADRAO,
+                           inline=True, style={'display': 'inline-block', 'marginRight': '30px'}),
+            dcc.Checklist(id='media-movel', options=[{'label': 'media movel de 7 dias (diario)', 'value': 'sim'}],
+                          value=[], inline=True, style={'display': 'inline-block'}),
+        ]),
         dcc.Graph(id='serie-temporal'),
     ], style={'marginBottom': '30px'}),
 
@@ -137,20 +706,778 @@ app.layout = html.Div([
     Input('municipio-select','id')
 )
 def populate_municipios(_):
-    if df.empty or 'municipio' not in df.columns:
-        return []
-    opts = [{'label': str(m), 'value': str(m)} for m in sorted(df['municipio'].dropna().unique())]
+    opts = [{'label': str(m), 'value': str(m)} for m in consultas.municipios()]
     return opts
 
-def filter_dataframe(municipios, start_date, end_date):
-    dff = df.copy()
-    if municipios and len(municipios) > 0:
-        dff = dff[dff['municipio'].isin(municipios)]
-    if start_date and 'dataNotificacao' in dff.columns:
-        dff = dff[dff['dataNotificacao'] >= pd.to_datetime(start_date)]
-    if end_date and 'dataNotificacao' in dff.columns:
-        dff = dff[dff['dataNotificacao'] <= pd.to_datetime(end_date)]
-    return dff
+class NaoGuardar(Exception):
+    # levantada dentro de calcular() para devolver um valor sem guarda-lo no cache
+    def __init__(self, valor):
+        self.valor = valor
+
+class CacheLRU:
+    # cache LRU com limite de itens e de memoria; chamadas concorrentes para a
+    # mesma chave esperam o primeiro calculo em vez de repetir o trabalho
+    def __init__(self, max_itens, max_bytes, medir_tamanho):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.medir_tamanho = medir_tamanho
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._calculando = {}
+        self._lock = threading.Lock()
+
+    def obter(self, chave, calcular):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                return self._itens[chave][0]
+            trava = self._calculando.setdefault(chave, threading.Lock())
+
+        with trava:
+            with self._lock:
+                if chave in self._itens:
+                    self._itens.move_to_end(chave)
+                    return self._itens[chave][0]
+            try:
+                valor = calcular()
+                self._guardar(chave, valor)
+            except NaoGuardar as e:
+                return e.valor
+            finally:
+                with self._lock:
+                    self._calculando.pop(chave, None)
+        return valor
+
+    def _guardar(self, chave, valor):
+        tamanho = self.medir_tamanho(valor)
+        with self._lock:
+            # resultados maiores que o orcamento inteiro nao sao guardados
+            if tamanho > self.max_bytes:
+                return
+            self._itens[chave] = (valor, tamanho)
+            self._bytes += tamanho
+            while self._itens and (len(self._itens) > self.max_itens or self._bytes > self.max_bytes):
+                _, (_, tamanho_antigo) = self._itens.popitem(last=False)
+                self._bytes -= tamanho_antigo
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+cache_filtros = CacheLRU(CACHE_FILTROS_MAX_ITENS, CACHE_FILTROS_MAX_MB * 1024 * 1024, lambda linhas: linhas.nbytes)
+
+cache_agregados = CacheLRU(CACHE_FILTROS_MAX_ITENS, CACHE_FILTROS_MAX_MB * 1024 * 1024, lambda agregados: tamanho_agregados(agregados))
+
+cache_figuras = CacheLRU(CACHE_FIGURAS_MAX_ITENS, CACHE_FIGURAS_MAX_MB * 1024 * 1024, len)
+
+# incrementada a cada recarga de dados; faz parte da chave das figuras para
+# que nenhum resultado antigo seja servido
+versao_dados = 0
+
+def invalidar_caches():
+    global versao_dados
+    versao_dados += 1
+    cache_filtros.limpar()
+    cache_agregados.limpar()
+    cache_figuras.limpar()
+
+def figura_de_erro(fig):
+    return any(str(a.text).startswith('erro') for a in fig.layout.annotations)
+
+def cache_figura(id_grafico, chave_extras=None):
+    # guarda o json da figura por (grafico, filtro, extras); um acerto devolve o
+    # json ja pronto sem passar por pandas nem plotly. chave_extras reduz os
+    # argumentos extras ao que a figura de fato usa (ex.: a vista do mapa)
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(municipios, start_date, end_date, *extras):
+            chave = (id_grafico, normalizar_filtro(municipios, start_date, end_date),
+                     json.dumps(chave_extras(*extras) if chave_extras else extras, sort_keys=True, default=str),
+                     versao_dados)
+
+            def calcular():
+                fig = funcao(municipios, start_date, end_date, *extras)
+                if figura_de_erro(fig):
+                    raise NaoGuardar(fig)
+                return pio.to_json(fig, validate=False)
+
+            resultado = cache_figuras.obter(chave, calcular)
+            return json.loads(resultado) if isinstance(resultado, str) else resultado
+        return envolvida
+    return decorador
+
+def normalizar_filtro(municipios, start_date, end_date):
+    munics = tuple(sorted(set(str(m) for m in municipios))) if municipios else ()
+    inicio = pd.to_datetime(start_date) if start_date else None
+    fim = pd.to_datetime(end_date) if end_date else None
+    return (munics, inicio, fim)
+
+def selecionar_linhas(municipios, start_date, end_date):
+    # posicoes (inteiras) das linhas de df que passam no filtro; o calculo e
+    # feito uma vez por estado de filtro e compartilhado entre os callbacks
+    chave = normalizar_filtro(municipios, start_date, end_date)
+    return cache_filtros.obter(chave + (versao_dados,), lambda: _calcular_selecao(*chave))
+
+def _calcular_selecao(municipios, start_date, end_date):
+    inicio, fim = intervalo_datas(start_date, end_date)
+    if municipios and 'municipios' in indices:
+        return linhas_municipios(municipios, inicio, fim)
+    return np.arange(inicio, fim)
+
+def linhas_municipios(municipios, inicio, fim):
+    # uniao das listas de linhas de cada municipio, recortadas ao periodo
+    indice = indices['municipios']
+    partes = []
+    for municipio in municipios:
+        codigo = indice['codigo'].get(municipio)
+        if codigo is None:
+            continue
+        linhas = indice['linhas'][indice['limites'][codigo]:indice['limites'][codigo + 1]]
+        partes.append(linhas[np.searchsorted(linhas, inicio):np.searchsorted(linhas, fim)])
+    if not partes:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(partes))
+
+def intervalo_datas(start_date, end_date):
+    # com df ordenado por data, o periodo vira uma fatia contigua [inicio, fim).
+    # o periodo vale por dia inteiro, como no cubo e nos cartoes
+    if 'datas' not in indices or (not start_date and not end_date):
+        return 0, len(df)
+    datas = indices['datas']
+    inicio = int(np.searchsorted(datas, np.datetime64(start_date.ceil('D')), side='left')) if start_date else 0
+    fim = (int(np.searchsorted(datas, np.datetime64(end_date.floor('D') + pd.Timedelta(days=1)), side='left'))
+           if end_date else len(datas))
+    return inicio, max(inicio, fim)
+
+def _calcular_selecao_cubo(municipios, start_date, end_date):
+    if 'cubo' not in indices:
+        return np.empty(0, dtype=np.int64)
+    cubo = indices['cubo']
+    inicio, fim = 0, len(cubo['n'])
+    if 'datas' in indices and (start_date or end_date):
+        # as celulas estao ordenadas por dia e as sem data ficam no fim
+        if start_date:
+            inicio = int(np.searchsorted(cubo['dia'], dia_numero(start_date.ceil('D')), side='left'))
+        if end_date:
+            fim = int(np.searchsorted(cubo['dia'], dia_numero(end_date.floor('D')), side='right'))
+        else:
+            fim = int(np.searchsorted(cubo['dia'], DIA_SEM_DATA, side='left'))
+    posicoes = np.arange(inicio, max(inicio, fim))
+    if municipios and 'municipios' in indices:
+        codigos = [indices['municipios']['codigo'][m] for m in municipios if m in indices['municipios']['codigo']]
+        posicoes = posicoes[np.isin(cubo['municipio'][posicoes], codigos)]
+    return posicoes
+
+def calcular_indicadores(municipios, start_date, end_date):
+    return consultas.indicadores(*normalizar_filtro(municipios, start_date, end_date))
+
+def _calcular_indicadores(municipios, start_date, end_date):
+    # totais dos cartoes pelas somas prefixadas: duas buscas e uma subtracao por
+    # municipio, independente do numero de notificacoes do periodo
+    if 'acumulados' not in indices:
+        return 0, 0, 0
+    acumulados = indices['acumulados']
+    dias = acumulados['dias']
+    inicio, fim = 0, len(dias)
+    if 'datas' in indices and (start_date or end_date):
+        if start_date:
+            inicio = int(np.searchsorted(dias, dia_numero(start_date.ceil('D')), side='left'))
+        if end_date:
+            fim = int(np.searchsorted(dias, dia_numero(end_date.floor('D')), side='right'))
+        else:
+            fim = int(np.searchsorted(dias, DIA_SEM_DATA, side='left'))
+    fim = max(inicio, fim)
+
+    if municipios and 'municipios' in indices:
+        codigos = np.array([indices['municipios']['codigo'][m] for m in municipios
+                            if m in indices['municipios']['codigo']], dtype=np.int64)
+    elif 'municipios' in indices:
+        codigos = np.arange(len(indices['municipios']['nomes']), dtype=np.int64)
+    else:
+        codigos = np.empty(0, dtype=np.int64)
+    base = (codigos + 1) * (len(dias) + 1)
+    de = np.searchsorted(acumulados['chaves'], base + inicio, side='left')
+    ate = np.searchsorted(acumulados['chaves'], base + fim, side='left')
+    municipios_afetados = int(np.count_nonzero(acumulados['total_chave'][ate] > acumulados['total_chave'][de]))
+
+    if municipios and 'municipios' in indices:
+        total = int((acumulados['total_chave'][ate] - acumulados['total_chave'][de]).sum())
+        confirmados = int((acumulados['confirmados_chave'][ate] - acumulados['confirmados_chave'][de]).sum())
+    else:
+        total = int(acumulados['total'][fim] - acumulados['total'][inicio])
+        confirmados = int(acumulados['confirmados'][fim] - acumulados['confirmados'][inicio])
+    return total, confirmados, municipios_afetados
+
+def dia_numero(data):
+    return int(np.datetime64(data, 'D').astype(np.int64))
+
+def calcular_agregados(municipios, start_date, end_date):
+    # todas as contagens da pagina para um estado de filtro, calculadas numa
+    # unica passada sobre as celulas selecionadas e guardadas no servidor; os
+    # callbacks dos graficos so formatam o resultado
+    chave = normalizar_filtro(municipios, start_date, end_date)
+    return cache_agregados.obter(chave + (versao_dados,), lambda: consultas.agregados(*chave))
+
+def agregados_vazios():
+    return {
+        'total': 0, 'confirmados': 0, 'municipios_afetados': 0,
+        'por_dia': {'inicio': 0, 'total': np.zeros(0, dtype=np.int64), 'confirmados': np.zeros(0, dtype=np.int64)},
+        'por_sexo': pd.DataFrame(columns=['sexo', 'count']),
+        'por_idade': pd.Series(dtype='int64'),
+        'por_municipio': pd.DataFrame(columns=['municipio', 'count']),
+        'sintomas': pd.Series(dtype='int64'),
+    }
+
+def _calcular_agregados(municipios, start_date, end_date):
+    agregados = agregados_vazios()
+    if 'cubo' not in indices:
+        return agregados
+    cubo = indices['cubo']
+    posicoes = _calcular_selecao_cubo(municipios, start_date, end_date)
+    celulas = pd.DataFrame({
+        'n': cubo['n'][posicoes],
+        'confirmados': cubo['n'][posicoes] * cubo['positivo'][posicoes],
+        'sexo': cubo['sexo'][posicoes],
+        'idade': cubo['idade'][posicoes],
+        'municipio': cubo['municipio'][posicoes],
+    })
+    agregados['total'] = int(celulas['n'].sum())
+    agregados['confirmados'] = int(celulas['confirmados'].sum())
+
+    por_municipio = celulas.groupby('municipio')['n'].sum()
+    por_municipio = por_municipio[por_municipio.index >= 0]
+    agregados['municipios_afetados'] = len(por_municipio)
+    if 'municipios' in indices:
+        agregados['por_municipio'] = pd.DataFrame({
+            'municipio': indices['municipios']['nomes'][por_municipio.index.to_numpy()],
+            'count': por_municipio.to_numpy(),
+        }).sort_values('municipio', kind='stable').reset_index(drop=True)
+
+    # serie diaria continua (dias sem notificacao valem 0) entre o primeiro e o
+    # ultimo dia selecionado; as celulas ja estao ordenadas por dia
+    dias = cubo['dia'][posicoes]
+    datados = dias != DIA_SEM_DATA
+    if datados.any():
+        inicio = int(dias[datados][0])
+        deslocamento = dias[datados] - inicio
+        agregados['por_dia'] = {
+            'inicio': inicio,
+            'total': np.bincount(deslocamento, weights=celulas['n'].to_numpy()[datados]).astype(np.int64),
+            'confirmados': np.bincount(deslocamento, weights=celulas['confirmados'].to_numpy()[datados]).astype(np.int64),
+        }
+
+    por_sexo = celulas.groupby('sexo')['n'].sum()
+    por_sexo = por_sexo[por_sexo.index >= 0]
+    agregados['por_sexo'] = pd.DataFrame({
+        'sexo': cubo['sexos'][por_sexo.index.to_numpy()],
+        'count': por_sexo.to_numpy(),
+    }).sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+    por_idade = celulas.groupby('idade')['n'].sum()
+    agregados['por_idade'] = por_idade[por_idade.index != IDADE_SEM_VALOR]
+
+    if 'sintomas' in indices and agregados['total'] > 0:
+        agregados['sintomas'] = contar_sintomas(selecionar_linhas(municipios, start_date, end_date))
+    return agregados
+
+def tamanho_agregados(agregados):
+    tamanho = 0
+    for valor in agregados.values():
+        if hasattr(valor, 'memory_usage'):
+            tamanho += int(np.sum(valor.memory_usage(deep=True)))
+        elif isinstance(valor, dict):
+            tamanho += sum(v.nbytes for v in valor.values() if isinstance(v, np.ndarray))
+    return tamanho
+
+trava_colunas = threading.Lock()
+
+def garantir_colunas(colunas):
+    # carrega do parquet colunas ainda nao lidas, na mesma ordem de linhas de df
+    global df
+    disponiveis = {c for fonte in fontes if fonte['colunas'] is not None for c in fonte['colunas']}
+    faltando = [c for c in colunas if c not in df.columns and c in disponiveis]
+    if not faltando:
+        return
+    with trava_colunas:
+        faltando = [c for c in faltando if c not in df.columns]
+        if not faltando:
+            return
+        print(f"carregando colunas sob demanda: {faltando}")
+        # o indice de df e o id da linha: a posicao na concatenacao das fontes
+        novas = pd.concat([ler_fonte(fonte, faltando) for fonte in fontes], ignore_index=True)
+        novas = otimizar_tipos(novas).take(df.index.to_numpy())
+        novas.index = df.index
+        # df e substituido (e nao alterado) para nao afetar leituras em andamento
+        df = pd.concat([df, novas], axis=1)
+
+# ============= RECARGA INCREMENTAL =============
+
+def ler_fonte(fonte, colunas):
+    # le as colunas pedidas de uma fonte (arquivo inteiro ou faixa de row
+    # groups); colunas que o arquivo nao tem voltam vazias
+    presentes = [c for c in colunas if fonte['colunas'] is None or c in fonte['colunas']]
+    if fonte['grupos'] is None:
+        parte = safe_load_parquet(fonte['caminho'], columns=presentes, filters=fonte.get('filtros'))
+    else:
+        import pyarrow.parquet as pq
+        arquivo = pq.ParquetFile(fonte['caminho'])
+        parte = arquivo.read_row_groups(range(*fonte['grupos']), columns=presentes).to_pandas()
+    return parte.reindex(columns=colunas)
+
+def novas_fontes(diretorio):
+    # arquivos que ainda nao foram lidos e row groups acrescentados aos ja lidos
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        pq = None
+    novas = []
+    for nome in sorted(os.listdir(diretorio)):
+        caminho = os.path.join(diretorio, nome)
+        if not nome.endswith('.parquet') or os.path.abspath(caminho) == os.path.abspath(data_path):
+            continue
+        if pq is None:
+            if caminho not in grupos_lidos:
+                novas.append({'caminho': caminho, 'grupos': None, 'colunas': None})
+            continue
+        try:
+            metadados = pq.ParquetFile(caminho)
+        except Exception:
+            # arquivo ainda sendo copiado (sem rodape): tenta na proxima verificacao
+            continue
+        lidos = grupos_lidos.get(caminho, 0)
+        total = metadados.metadata.num_row_groups
+        if total > lidos:
+            novas.append({'caminho': caminho, 'grupos': (lidos, total), 'colunas': metadados.schema_arrow.names})
+    return novas
+
+def alinhar_tipos(df, novas):
+    # as partes precisam do mesmo dtype para o concat nao virar object; categorias
+    # novas entram no fim, sem mudar os codigos das linhas ja carregadas
+    df = df.copy(deep=False)
+    for coluna in df.columns:
+        if coluna not in novas.columns:
+            continue
+        tipo = df[coluna].dtype
+        if isinstance(tipo, pd.CategoricalDtype):
+            extras = pd.Index(novas[coluna].dropna().unique()).difference(tipo.categories)
+            if len(extras):
+                df[coluna] = df[coluna].cat.add_categories(extras)
+            novas[coluna] = novas[coluna].astype(df[coluna].dtype)
+        else:
+            try:
+                novas[coluna] = novas[coluna].astype(tipo)
+            except (TypeError, ValueError):
+                # valor fora da faixa do tipo reduzido: o concat promove o tipo
+                pass
+    return df, novas
+
+def codificar_municipios(municipios, codigo):
+    valores, unicos = pd.factorize(municipios)
+    mapa = np.array([codigo.get(str(m), -1) for m in unicos] + [-1], dtype=np.int64)
+    return mapa[valores]
+
+def combinar_cubos(cubo, novo):
+    sexos = list(cubo['sexos'])
+    sexos += [sexo for sexo in novo['sexos'] if sexo not in sexos]
+    mapa = np.array([sexos.index(sexo) for sexo in novo['sexos']] + [-1], dtype=np.int64)
+    chaves = ['dia', 'municipio', 'sexo', 'idade', 'positivo']
+    novas_celulas = pd.DataFrame({c: novo[c] for c in chaves + ['n']})
+    novas_celulas['sexo'] = mapa[novo['sexo']]
+    celulas = pd.concat([pd.DataFrame({c: cubo[c] for c in chaves + ['n']}), novas_celulas])
+    celulas = celulas.groupby(chaves)['n'].sum().reset_index()
+    combinado = {coluna: celulas[coluna].to_numpy() for coluna in celulas.columns}
+    combinado['sexos'] = np.asarray(sexos, dtype=object)
+    return combinado
+
+def combinar_sintomas(matriz, nova):
+    # sintomas novos ganham os bits seguintes; as linhas antigas so recebem
+    # bytes zerados se a matriz ficar mais larga
+    nomes = list(matriz['nomes'])
+    nomes += [nome for nome in nova['nomes'] if nome not in nomes]
+    largura = (max(len(nomes), 1) + 7) // 8
+    antigos = matriz['bits']
+    if antigos.shape[1] < largura:
+        antigos = np.hstack([antigos, np.zeros((len(antigos), largura - antigos.shape[1]), dtype=np.uint8)])
+    flags = np.unpackbits(nova['bits'], axis=1)[:, :len(nova['nomes'])]
+    destino = np.zeros((len(flags), largura * 8), dtype=np.uint8)
+    destino[:, [nomes.index(nome) for nome in nova['nomes']]] = flags
+    return np.asarray(nomes, dtype=object), np.vstack([antigos, np.packbits(destino, axis=1)])
+
+def anexar_linhas(df, indices, lidas):
+    # so as linhas novas passam por preprocess, cubo e matriz de sintomas; as
+    # estruturas por linha sao reordenadas por data com operacoes vetorizadas
+    novas = otimizar_tipos(preprocess_data(lidas))
+    if df.empty:
+        return novas, construir_indices(novas)
+    df, novas = alinhar_tipos(df, novas)
+    combinado = pd.concat([df, novas])
+    ordem = np.arange(len(combinado))
+    if 'dataNotificacao' in combinado.columns:
+        chave = combinado['dataNotificacao'].to_numpy().view(np.int64).copy()
+        chave[combinado['dataNotificacao'].isna().to_numpy()] = np.iinfo(np.int64).max
+        ordem = np.argsort(chave, kind='stable')
+    combinado = combinado.take(ordem)
+
+    atualizados = {}
+    if 'dataNotificacao' in combinado.columns:
+        atualizados['datas'] = combinado['dataNotificacao'].to_numpy()[:int(combinado['dataNotificacao'].notna().sum())]
+    codigos_novas = None
+    if 'municipios' in indices:
+        nomes = list(indices['municipios']['nomes'])
+        codigo = dict(indices['municipios']['codigo'])
+        for municipio in pd.unique(novas['municipio'].dropna()):
+            if str(municipio) not in codigo:
+                codigo[str(municipio)] = len(nomes)
+                nomes.append(municipio)
+        atualizados['municipios'] = indice_municipios(codificar_municipios(combinado['municipio'], codigo),
+                                                      np.asarray(nomes, dtype=object))
+        codigos_novas = codificar_municipios(novas['municipio'], codigo)
+    atualizados['cubo'] = combinar_cubos(indices['cubo'], construir_cubo(novas, codigos_novas))
+    atualizados['acumulados'] = construir_acumulados(atualizados['cubo'])
+    if 'sintomas' in indices:
+        nomes, bits = combinar_sintomas(indices['sintomas'], construir_matriz_sintomas(novas['sintomas']))
+        atualizados['sintomas'] = {'nomes': nomes, 'bits': bits[ordem]}
+    return combinado, atualizados
+
+def recarregar_incremental(diretorio):
+    global df, indices
+    novas = novas_fontes(diretorio)
+    if not novas:
+        return 0
+    with trava_colunas:
+        if df.empty:
+            colunas = [c for c in colunas_graficos()
+                       if any(fonte['colunas'] is None or c in fonte['colunas'] for fonte in novas)]
+        else:
+            colunas = [c for c in df.columns if c not in COLUNAS_DERIVADAS]
+        partes = []
+        for fonte in novas:
+            parte = ler_fonte(fonte, colunas)
+            fonte['linhas'] = len(parte)
+            partes.append(parte)
+        lidas = pd.concat(partes, ignore_index=True)
+        # ids continuam a numeracao das fontes ja carregadas; o recorte e
+        # aplicado depois, para os ids seguirem apontando a posicao na fonte
+        lidas.index = lidas.index + sum(fonte['linhas'] for fonte in fontes)
+        lidas = filtrar_recorte(lidas, filtros_recorte(list(lidas.columns)))
+        if len(lidas):
+            df_novo, indices_novos = anexar_linhas(df, indices, lidas)
+            # troca as referencias de uma vez; leituras em andamento terminam
+            # sobre os objetos antigos, que nunca sao alterados
+            df, indices = df_novo, indices_novos
+        fontes.extend(novas)
+        for fonte in novas:
+            grupos_lidos[fonte['caminho']] = fonte['grupos'][1] if fonte['grupos'] else None
+    invalidar_caches()
+    print(f"recarga incremental: {len(lidas)} linhas novas de {len(novas)} fonte(s), total {len(df)}")
+    return len(lidas)
+
+def vigiar_diretorio(diretorio, intervalo):
+    while True:
+        try:
+            recarregar_incremental(diretorio)
+        except Exception as e:
+            print(f"erro na recarga incremental: {e}")
+        time.sleep(intervalo)
+
+def filter_dataframe(municipios, start_date, end_date, colunas=None):
+    return consultas.linhas(municipios, start_date, end_date, colunas)
+
+# ============= BACKENDS DE CONSULTA =============
+
+class ConsultasPandas:
+    # consultas sobre o dataset em memoria e seus indices (padrao)
+    def sem_dados(self):
+        return df.empty
+
+    def tem_coluna(self, coluna):
+        return coluna in df.columns
+
+    def municipios(self):
+        if consultas.sem_dados() or not consultas.tem_coluna('municipio'):
+            return []
+        return sorted(df['municipio'].dropna().unique())
+
+    def agregados(self, municipios, inicio, fim):
+        return _calcular_agregados(municipios, inicio, fim)
+
+    def indicadores(self, municipios, inicio, fim):
+        return _calcular_indicadores(municipios, inicio, fim)
+
+    def linhas(self, municipios, start_date, end_date, colunas=None):
+        # df global nunca e copiado inteiro: so as colunas pedidas pelo grafico
+        # sao materializadas, e apenas nas linhas selecionadas
+        linhas = selecionar_linhas(municipios, start_date, end_date)
+        if colunas is not None:
+            garantir_colunas(colunas)
+            return df[[c for c in colunas if c in df.columns]].take(linhas)
+        return df.take(linhas)
+
+class ConsultasArrow:
+    # as mesmas consultas executadas direto no parquet (arquivo ou diretorio
+    # particionado) com pyarrow.dataset e pyarrow.compute: leitura, filtros e
+    # contagens rodam em varias threads e so as colunas/linhas do filtro sao lidas
+    COLUNAS_AGREGADOS = ['dataNotificacao', 'municipio', 'classificacaoFinal', 'sexo', 'idade', 'sintomas']
+
+    def __init__(self, path, filtros):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+        self.pa, self.pc, self.ds = pa, pc, ds
+        self.dataset = ds.dataset(path, format='parquet', partitioning='hive')
+        self.colunas = set(self.dataset.schema.names)
+        self.recorte = pq.filters_to_expression(filtros) if filtros else None
+        self.total_linhas = self.dataset.count_rows(filter=self.recorte)
+
+    def sem_dados(self):
+        return self.total_linhas == 0
+
+    def tem_coluna(self, coluna):
+        origem = {'ano_mes': 'dataNotificacao', 'ano_semana': 'dataNotificacao', 'positivo': 'classificacaoFinal'}
+        return origem.get(coluna, coluna) in self.colunas
+
+    def filtro(self, municipios, inicio, fim):
+        # mesma semantica do cubo: o periodo vale por dia inteiro
+        condicoes = [] if self.recorte is None else [self.recorte]
+        if 'dataNotificacao' in self.colunas:
+            if inicio is not None:
+                condicoes.append(self.ds.field('dataNotificacao') >= inicio.ceil('D'))
+            if fim is not None:
+                condicoes.append(self.ds.field('dataNotificacao') < fim.floor('D') + pd.Timedelta(days=1))
+        if municipios and 'municipio' in self.colunas:
+            condicoes.append(self.ds.field('municipio').isin(list(municipios)))
+        filtro = None
+        for condicao in condicoes:
+            filtro = condicao if filtro is None else filtro & condicao
+        return filtro
+
+    def tabela(self, colunas, municipios, inicio, fim):
+        return self.dataset.to_table(columns=[c for c in colunas if c in self.colunas],
+                                     filter=self.filtro(municipios, inicio, fim), use_threads=True)
+
+    def contar(self, coluna):
+        contagem = self.pc.value_counts(coluna.drop_null())
+        return pd.Series(contagem.field('counts').to_numpy(), index=contagem.field('values').to_pylist(), dtype='int64')
+
+    def municipios(self):
+        if 'municipio' not in self.colunas:
+            return []
+        tabela = self.dataset.to_table(columns=['municipio'], filter=self.recorte)
+        return sorted(self.pc.unique(tabela['municipio']).drop_null().to_pylist())
+
+    def agregados(self, municipios, inicio, fim):
+        pa, pc = self.pa, self.pc
+        agregados = agregados_vazios()
+        tabela = self.tabela(self.COLUNAS_AGREGADOS, municipios, inicio, fim)
+        colunas = tabela.column_names
+        agregados['total'] = tabela.num_rows
+        if tabela.num_rows == 0:
+            return agregados
+        positivo = np.zeros(tabela.num_rows, dtype=np.int64)
+        if 'classificacaoFinal' in colunas:
+            confirmado = pc.is_in(tabela['classificacaoFinal'], value_set=pa.array(CLASSIFICACOES_CONFIRMADAS))
+            positivo = confirmado.fill_null(False).to_numpy().astype(np.int64)
+        agregados['confirmados'] = int(positivo.sum())
+
+        if 'municipio' in colunas:
+            por_municipio = self.contar(tabela['municipio'])
+            agregados['municipios_afetados'] = len(por_municipio)
+            agregados['por_municipio'] = pd.DataFrame({
+                'municipio': np.asarray(por_municipio.index, dtype=object),
+                'count': por_municipio.to_numpy(),
+            }).sort_values('municipio', kind='stable').reset_index(drop=True)
+
+        if 'dataNotificacao' in colunas:
+            datas = tabela['dataNotificacao'].to_numpy()
+            datado = ~np.isnat(datas)
+            dias = datas[datado].astype('datetime64[D]').astype(np.int64)
+            if len(dias):
+                primeiro = int(dias.min())
+                agregados['por_dia'] = {
+                    'inicio': primeiro,
+                    'total': np.bincount(dias - primeiro).astype(np.int64),
+                    'confirmados': np.bincount(dias - primeiro, weights=positivo[datado]).astype(np.int64),
+                }
+
+        if 'sexo' in colunas:
+            por_sexo = self.contar(tabela['sexo'])
+            agregados['por_sexo'] = pd.DataFrame({
+                'sexo': np.asarray(por_sexo.index, dtype=object),
+                'count': por_sexo.to_numpy(),
+            }).sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+        if 'idade' in colunas:
+            idades = tabela['idade'].to_numpy(zero_copy_only=False).astype('float64')
+            valores, contagem = np.unique(idades[~np.isnan(idades)].astype(np.int16), return_counts=True)
+            agregados['por_idade'] = pd.Series(contagem.astype(np.int64), index=valores)
+
+        if 'sintomas' in colunas:
+            # o texto e separado uma vez por valor distinto, como na matriz de bits
+            sintomas = {}
+            for texto, n in self.contar(tabela['sintomas']).items():
+                for sintoma in separar_sintomas(texto):
+                    sintomas[sintoma] = sintomas.get(sintoma, 0) + int(n)
+            agregados['sintomas'] = pd.Series(sintomas, dtype='int64')
+        return agregados
+
+    def indicadores(self, municipios, inicio, fim):
+        agregados = calcular_agregados(municipios, inicio, fim)
+        return agregados['total'], agregados['confirmados'], agregados['municipios_afetados']
+
+    def linhas(self, municipios, start_date, end_date, colunas=None):
+        municipios, inicio, fim = normalizar_filtro(municipios, start_date, end_date)
+        return self.tabela(colunas or sorted(self.colunas), municipios, inicio, fim).to_pandas()
+
+# ============= CONSULTAS NO POSTGRESQL =============
+
+# filtro comum: periodo ($1, $2) e municipios ($3), nulos = sem filtro. o
+# municipio aqui e o de notificacao (notificacao.municipio_notificacao_id), nao
+# o de residencia da coluna 'municipio' dos outros backends: a residencia fica
+# em residencia_paciente, por paciente, e o migracao_db.py deduplica pacientes
+# por (idade, sexo, raca), entao um paciente tem varias residencias e a juncao
+# por ela atribuiria notificacoes a municipios errados
+FILTRO_BANCO = """
+    FROM notificacao n
+    LEFT JOIN municipio m ON m.municipio_id = n.municipio_notificacao_id
+    {juncoes}
+    WHERE ($1 IS NULL OR n.data_notificacao >= $1)
+      AND ($2 IS NULL OR n.data_notificacao <= $2)
+      AND ($3 IS NULL OR m.nome = ANY($3))
+"""
+JUNCAO_CLASSIFICACAO = """
+    LEFT JOIN dados_clinicos dc ON dc.notificacao_id = n.notificacao_id
+    LEFT JOIN classificacao_final cf ON cf.classificacao_final_id = dc.classificacao_final_id
+"""
+PARAMETROS_FILTRO = '(date, date, text[])'
+
+def classificacoes_confirmadas_banco():
+    # CLASSIFICACOES_CONFIRMADAS como o migracao_db.py grava (mapear_valor), para
+    # os backends contarem as mesmas classificacoes
+    from migracao_db import MAPEAMENTOS
+    mapeamento = MAPEAMENTOS['classificacao_final']
+    return [mapeamento.get(c.upper(), c) for c in CLASSIFICACOES_CONFIRMADAS]
+
+def consultas_banco(confirmadas):
+    # nome -> (tipos dos parametros, consulta); preparadas uma vez por conexao
+    confirmado = "count(*) FILTER (WHERE cf.descricao IN ({}))".format(
+        ', '.join("'" + c.replace("'", "''") + "'" for c in confirmadas))
+    return {
+        'dash_tem_dados': ('', "SELECT EXISTS (SELECT 1 FROM notificacao)"),
+        'dash_municipios': ('', """SELECT DISTINCT m.nome FROM notificacao n
+            JOIN municipio m ON m.municipio_id = n.municipio_notificacao_id ORDER BY 1"""),
+        'dash_por_municipio': (PARAMETROS_FILTRO, f"SELECT m.nome, count(*), {confirmado}"
+                               + FILTRO_BANCO.format(juncoes=JUNCAO_CLASSIFICACAO) + "GROUP BY m.nome"),
+        'dash_por_dia': (PARAMETROS_FILTRO, f"SELECT n.data_notificacao, count(*), {confirmado}"
+                         + FILTRO_BANCO.format(juncoes=JUNCAO_CLASSIFICACAO) + "GROUP BY 1 ORDER BY 1"),
+        'dash_por_sexo': (PARAMETROS_FILTRO, "SELECT s.descricao, count(*)" + FILTRO_BANCO.format(juncoes="""
+            JOIN paciente p ON p.paciente_id = n.paciente_id
+            JOIN sexo s ON s.sexo_id = p.sexo_id""") + "GROUP BY 1"),
+        'dash_por_idade': (PARAMETROS_FILTRO, "SELECT p.idade, count(*)" + FILTRO_BANCO.format(juncoes="""
+            JOIN paciente p ON p.paciente_id = n.paciente_id""") + "AND p.idade IS NOT NULL GROUP BY 1 ORDER BY 1"),
+        'dash_sintomas': (PARAMETROS_FILTRO, "SELECT si.descricao, count(*)" + FILTRO_BANCO.format(juncoes="""
+            JOIN notificacao_sintoma ns ON ns.notificacao_id = n.notificacao_id
+            JOIN sintoma si ON si.sintoma_id = ns.sintoma_id""") + "AND si.descricao <> 'NÃO INFORMADO' GROUP BY 1"),
+    }
+
+class ConsultasPostgres:
+    # as agregacoes rodam no PostgreSQL e so os totais chegam ao servidor web,
+    # que nao guarda notificacoes. conexoes vem de um pool compartilhado entre
+    # as threads e cada uma prepara as consultas (PREPARE) na primeira execucao
+    COLUNAS = {'dataNotificacao', 'municipio', 'classificacaoFinal', 'sexo', 'idade', 'sintomas',
+               'ano_mes', 'ano_semana', 'positivo'}
+
+    def __init__(self, config, minimo, maximo):
+        from psycopg2.pool import ThreadedConnectionPool
+        self.pool = ThreadedConnectionPool(minimo, maximo, **config)
+        self.consultas = consultas_banco(classificacoes_confirmadas_banco())
+        self.com_dados = False
+
+    def executar(self, nome, parametros=()):
+        from psycopg2 import errors
+        conexao = self.pool.getconn()
+        try:
+            conexao.autocommit = True
+            with conexao.cursor() as cursor:
+                marcadores = '(' + ', '.join(['%s'] * len(parametros)) + ')' if parametros else ''
+                try:
+                    cursor.execute(f"EXECUTE {nome}{marcadores}", parametros)
+                except errors.InvalidSqlStatementName:
+                    # conexao nova (ou que perdeu parte das preparadas): descarta
+                    # as que restaram e prepara todas as consultas de uma vez
+                    cursor.execute("DEALLOCATE ALL")
+                    for consulta, (tipos, sql) in self.consultas.items():
+                        cursor.execute(f"PREPARE {consulta}{tipos} AS {sql}")
+                    cursor.execute(f"EXECUTE {nome}{marcadores}", parametros)
+                return cursor.fetchall()
+        finally:
+            self.pool.putconn(conexao, close=bool(conexao.closed))
+
+    def parametros(self, municipios, inicio, fim):
+        # mesma semantica do cubo: o periodo vale por dia inteiro
+        return (inicio.ceil('D').date() if inicio is not None else None,
+                fim.floor('D').date() if fim is not None else None,
+                list(municipios) if municipios else None)
+
+    def sem_dados(self):
+        if not self.com_dados:
+            self.com_dados = self.executar('dash_tem_dados')[0][0]
+        return not self.com_dados
+
+    def tem_coluna(self, coluna):
+        return coluna in self.COLUNAS
+
+    def municipios(self):
+        return [nome for (nome,) in self.executar('dash_municipios')]
+
+    def agregados(self, municipios, inicio, fim):
+        agregados = agregados_vazios()
+        parametros = self.parametros(municipios, inicio, fim)
+        por_municipio = self.executar('dash_por_municipio', parametros)
+        if not por_municipio:
+            return agregados
+        # notificacoes sem municipio entram nos totais, mas nao na contagem por municipio
+        agregados['total'] = sum(total for _, total, _ in por_municipio)
+        agregados['confirmados'] = sum(confirmados for _, _, confirmados in por_municipio)
+        agregados['municipios_afetados'] = sum(nome is not None for nome, _, _ in por_municipio)
+        agregados['por_municipio'] = pd.DataFrame(
+            [(nome, total) for nome, total, _ in por_municipio if nome is not None], columns=['municipio', 'count']
+        ).sort_values('municipio', kind='stable').reset_index(drop=True)
+
+        por_dia = self.executar('dash_por_dia', parametros)
+        dias = np.array([dia for dia, _, _ in por_dia], dtype='datetime64[D]').astype(np.int64)
+        primeiro = int(dias[0])
+        agregados['por_dia'] = {
+            'inicio': primeiro,
+            'total': np.bincount(dias - primeiro, weights=[t for _, t, _ in por_dia]).astype(np.int64),
+            'confirmados': np.bincount(dias - primeiro, weights=[c for _, _, c in por_dia]).astype(np.int64),
+        }
+
+        agregados['por_sexo'] = pd.DataFrame(
+            self.executar('dash_por_sexo', parametros), columns=['sexo', 'count']
+        ).sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+        por_idade = self.executar('dash_por_idade', parametros)
+        agregados['por_idade'] = pd.Series([n for _, n in por_idade], index=np.array([i for i, _ in por_idade], dtype=np.int16),
+                                           dtype='int64')
+        agregados['sintomas'] = pd.Series(dict(self.executar('dash_sintomas', parametros)), dtype='int64')
+        return agregados
+
+    def indicadores(self, municipios, inicio, fim):
+        agregados = calcular_agregados(municipios, inicio, fim)
+        return agregados['total'], agregados['confirmados'], agregados['municipios_afetados']
+
+    def linhas(self, municipios, start_date, end_date, colunas=None):
+        # o banco nao tem coordenadas e o servidor nao recebe notificacoes: um
+        # registro por municipio, o que leva o mapa ao grafico por municipio
+        return calcular_agregados(municipios, start_date, end_date)['por_municipio']
+
+if BACKEND == 'postgres':
+    consultas = ConsultasPostgres(DB_CONFIG, POOL_MIN_CONEXOES, POOL_MAX_CONEXOES)
+elif BACKEND == 'arrow' and os.path.exists(data_path):
+    consultas = ConsultasArrow(data_path, filtros_recorte(colunas_do_arquivo(data_path)))
+else:
+    consultas = ConsultasPandas()
 
 @app.callback(
     [Output('total-notificacoes','children'),
@@ -162,11 +1489,9 @@ def filter_dataframe(municipios, start_date, end_date):
 )
 def update_metrics(municipios, start_date, end_date):
     try:
-        dff = filter_dataframe(municipios, start_date, end_date)
-        
-        total = len(dff)
-        confirmados = int(dff['positivo'].sum()) if 'positivo' in dff.columns else 0
-        munic = dff['municipio'].nunique() if 'municipio' in dff.columns else 0
+        total, confirmados, munic = calcular_indicadores(municipios, start_date, end_date)
+        confirmados = confirmados if consultas.tem_coluna('positivo') else 0
+        munic = munic if consultas.tem_coluna('municipio') else 0
         
         return (
             html.Div([html.H2(f"{total:,}"), html.P("total de notificacoes")]),
@@ -181,46 +1506,99 @@ def update_metrics(municipios, start_date, end_date):
             html.Div([html.H2("erro"), html.P("erro ao calcular")])
         )
 
+def agrupar_serie(por_dia, granularidade, media_movel=False):
+    # reduz a serie diaria por periodo com np.add.reduceat: os dias viram numeros
+    # inteiros e cada periodo e um intervalo contiguo deles
+    dias = por_dia['inicio'] + np.arange(len(por_dia['total']))
+    total = por_dia['total']
+    confirmados = por_dia['confirmados']
+    if media_movel and granularidade == 'dia':
+        total = media_movel_dias(total, JANELA_MEDIA_MOVEL)
+        confirmados = media_movel_dias(confirmados, JANELA_MEDIA_MOVEL)
+
+    if granularidade == 'dia':
+        grupos = dias
+    elif granularidade == 'semana':
+        # semanas de segunda a domingo, como to_period('W') (1970-01-01 foi quinta)
+        grupos = (dias + 3) // 7
+    elif granularidade == 'semana_epi':
+        # semana epidemiologica: domingo a sabado
+        grupos = (dias + 4) // 7
+    else:
+        grupos = dias.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    cortes = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]]) if len(dias) else np.zeros(0, dtype=np.int64)
+
+    if granularidade == 'mes':
+        periodo = np.datetime_as_string(grupos[cortes].astype('datetime64[M]'))
+    elif granularidade == 'semana':
+        periodo = np.datetime_as_string((grupos[cortes] * 7 - 3).astype('datetime64[D]'))
+    elif granularidade == 'semana_epi':
+        periodo = np.datetime_as_string((grupos[cortes] * 7 - 4).astype('datetime64[D]'))
+    else:
+        periodo = np.datetime_as_string(dias.astype('datetime64[D]'))
+    serie = pd.DataFrame({
+        'periodo': periodo,
+        'total': np.add.reduceat(total, cortes) if len(cortes) else total,
+        'confirmados': np.add.reduceat(confirmados, cortes) if len(cortes) else confirmados,
+    })
+    if granularidade == 'semana_epi':
+        serie['rotulo'] = rotulo_semana_epi(grupos[cortes] * 7 - 4)
+    return serie
+
+def media_movel_dias(valores, janela):
+    # media movel para tras; os primeiros dias usam os dias disponiveis
+    acumulado = np.concatenate([[0.0], np.cumsum(valores)])
+    posicoes = np.arange(1, len(valores) + 1)
+    inicio = np.maximum(posicoes - janela, 0)
+    return (acumulado[posicoes] - acumulado[inicio]) / (posicoes - inicio)
+
+def rotulo_semana_epi(domingos):
+    # a semana pertence ao ano da sua quarta-feira; a semana 1 e a que contem a
+    # primeira quarta-feira do ano
+    quartas = (domingos + 3).astype('datetime64[D]')
+    anos = quartas.astype('datetime64[Y]')
+    numeros = (quartas - anos.astype('datetime64[D]')).astype(np.int64) // 7 + 1
+    return [f"SE {n:02d}/{a}" for n, a in zip(numeros, np.datetime_as_string(anos))]
+
 @app.callback(
     Output('serie-temporal','figure'),
     [Input('municipio-select','value'), 
      Input('date-range','start_date'), 
-     Input('date-range','end_date')]
+     Input('date-range','end_date'),
+     Input('granularidade-serie','value'),
+     Input('media-movel','value')]
 )
-def update_serie(municipios, start_date, end_date):
+@cache_figura('serie-temporal')
+def update_serie(municipios, start_date, end_date, granularidade=GRANULARIDADE_PADRAO, media_movel=None):
     try:
-        if df.empty:
+        if consultas.sem_dados():
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado disponivel", showarrow=False, font=dict(size=20))
             return fig
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        agregados = calcular_agregados(municipios, start_date, end_date)
         
-        if len(dff) == 0:
+        if agregados['total'] == 0:
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado para os filtros selecionados", showarrow=False, font=dict(size=16))
             return fig
         
-        if 'ano_mes' not in dff.columns:
+        if not consultas.tem_coluna('ano_mes'):
             fig = go.Figure()
             fig.add_annotation(text="coluna de data nao encontrada", showarrow=False, font=dict(size=20))
             return fig
 
-        if 'positivo' in dff.columns:
-            agg = dff.groupby('ano_mes').agg({
-                'positivo': 'sum'
-            }).reset_index()
-            agg.columns = ['ano_mes', 'confirmados']
-            
-            total_por_mes = dff.groupby('ano_mes').size().reset_index(name='total')
-            agg = agg.merge(total_por_mes, on='ano_mes', how='left')
+        agg = agrupar_serie(agregados['por_dia'], granularidade or GRANULARIDADE_PADRAO, bool(media_movel))
+        texto = agg['rotulo'] if 'rotulo' in agg.columns else None
+
+        if consultas.tem_coluna('positivo'):
             agg['negativos'] = agg['total'] - agg['confirmados']
-            agg = agg.sort_values('ano_mes')
             
             fig = go.Figure()
             fig.add_trace(go.Scatter(
-                x=agg['ano_mes'], 
+                x=agg['periodo'], 
                 y=agg['confirmados'], 
+                text=texto,
                 mode='lines+markers', 
                 name='confirmados', 
                 line=dict(color='#e74c3c', width=3),
@@ -228,8 +1606,9 @@ def update_serie(municipios, start_date, end_date):
                 fillcolor='rgba(231, 76, 60, 0.2)'
             ))
             fig.add_trace(go.Scatter(
-                x=agg['ano_mes'], 
+                x=agg['periodo'], 
                 y=agg['negativos'], 
+                text=texto,
                 mode='lines+markers', 
                 name='descartados/suspeitos', 
                 line=dict(color='#95a5a6', width=2)
@@ -246,9 +1625,8 @@ def update_serie(municipios, start_date, end_date):
                 legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
             )
         else:
-            agg = dff.groupby('ano_mes').size().reset_index(name='count')
-            agg = agg.sort_values('ano_mes')
-            fig = px.line(agg, x='ano_mes', y='count', title='evolucao temporal de notificacoes', markers=True)
+            agg = agg.rename(columns={'total': 'count'})
+            fig = px.line(agg, x='periodo', y='count', title='evolucao temporal de notificacoes', markers=True)
             fig.update_traces(line=dict(color='#3498db', width=3))
             fig.update_layout(
                 plot_bgcolor='#f8f9fa',
@@ -273,22 +1651,22 @@ def update_serie(municipios, start_date, end_date):
      Input('date-range','start_date'), 
      Input('date-range','end_date')]
 )
+@cache_figura('dist-sex')
 def dist_sex(municipios, start_date, end_date):
     try:
-        if df.empty or 'sexo' not in df.columns:
+        if consultas.sem_dados() or not consultas.tem_coluna('sexo'):
             fig = go.Figure()
             fig.add_annotation(text="dados de sexo indisponiveis", showarrow=False, font=dict(size=16))
             return fig
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        agregados = calcular_agregados(municipios, start_date, end_date)
         
-        if len(dff) == 0:
+        if agregados['total'] == 0:
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado para os filtros selecionados", showarrow=False, font=dict(size=14))
             return fig
         
-        counts = dff['sexo'].value_counts().reset_index()
-        counts.columns = ['sexo','count']
+        counts = agregados['por_sexo']
         
         fig = px.pie(counts, names='sexo', values='count', title='distribuicao por sexo',
                      color_discrete_sequence=px.colors.qualitative.Set2,
@@ -308,23 +1686,34 @@ def dist_sex(municipios, start_date, end_date):
      Input('date-range','start_date'), 
      Input('date-range','end_date')]
 )
+@cache_figura('dist-idade')
 def dist_idade(municipios, start_date, end_date):
     try:
-        if df.empty or 'idade' not in df.columns:
+        if consultas.sem_dados() or not consultas.tem_coluna('idade'):
             fig = go.Figure()
             fig.add_annotation(text="dados de idade indisponiveis", showarrow=False, font=dict(size=16))
             return fig
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        agregados = calcular_agregados(municipios, start_date, end_date)
         
-        if len(dff) == 0:
+        if agregados['total'] == 0:
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado para os filtros selecionados", showarrow=False, font=dict(size=14))
             return fig
         
-        fig = px.histogram(dff, x='idade', nbins=40, title='distribuicao de idades',
-                          color_discrete_sequence=['#3498db'])
+        # as faixas sao somadas aqui; o navegador recebe so as alturas das barras
+        inicio, largura, frequencias = faixas_idade(agregados['por_idade'], HISTOGRAMA_IDADE_FAIXAS)
+        esquerdas = inicio + largura * np.arange(len(frequencias))
+        fig = go.Figure(go.Bar(
+            x=esquerdas + largura / 2,
+            y=frequencias,
+            width=largura,
+            marker_color='#3498db',
+            customdata=np.column_stack([esquerdas, esquerdas + largura - 1]),
+            hovertemplate='idade=%{customdata[0]}-%{customdata[1]}<br>frequencia=%{y}<extra></extra>'
+        ))
         fig.update_layout(
+            title='distribuicao de idades',
             plot_bgcolor='#f8f9fa',
             xaxis_title='idade',
             yaxis_title='frequencia',
@@ -338,28 +1727,39 @@ def dist_idade(municipios, start_date, end_date):
         fig.add_annotation(text=f"erro: {str(e)}", showarrow=False, font=dict(size=14))
         return fig
 
+def faixas_idade(idades, n_faixas):
+    # idades inteiras: faixas de largura inteira cobrindo [min, max], somadas com bincount
+    idades = idades[idades.index >= 0]
+    if len(idades) == 0:
+        return 0, 1, np.zeros(0, dtype=np.int64)
+    valores = idades.index.to_numpy(dtype=np.int64)
+    inicio = int(valores.min())
+    largura = max(1, -(-(int(valores.max()) - inicio + 1) // n_faixas))
+    frequencias = np.bincount((valores - inicio) // largura, weights=idades.to_numpy(), minlength=1)
+    return inicio, largura, frequencias.astype(np.int64)
+
 @app.callback(
     Output('casos-sex','figure'),
     [Input('municipio-select','value'), 
      Input('date-range','start_date'), 
      Input('date-range','end_date')]
 )
+@cache_figura('casos-sex')
 def casos_sex(municipios, start_date, end_date):
     try:
-        if df.empty or 'sexo' not in df.columns:
+        if consultas.sem_dados() or not consultas.tem_coluna('sexo'):
             fig = go.Figure()
             fig.add_annotation(text="dados de sexo indisponiveis", showarrow=False, font=dict(size=16))
             return fig
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        agregados = calcular_agregados(municipios, start_date, end_date)
         
-        if len(dff) == 0:
+        if agregados['total'] == 0:
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado para os filtros selecionados", showarrow=False, font=dict(size=14))
             return fig
         
-        counts = dff['sexo'].value_counts().reset_index()
-        counts.columns = ['sexo', 'casos']
+        counts = agregados['por_sexo'].rename(columns={'count': 'casos'})
         counts = counts.sort_values('casos', ascending=True)
         
         fig = px.bar(counts, x='casos', y='sexo', orientation='h',
@@ -386,29 +1786,32 @@ def casos_sex(municipios, start_date, end_date):
      Input('date-range','start_date'), 
      Input('date-range','end_date')]
 )
+@cache_figura('casos-idade')
 def casos_idade(municipios, start_date, end_date):
     try:
-        if df.empty or 'idade' not in df.columns:
+        if consultas.sem_dados() or not consultas.tem_coluna('idade'):
             fig = go.Figure()
             fig.add_annotation(text="dados de idade indisponiveis", showarrow=False, font=dict(size=16))
             return fig
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        agregados = calcular_agregados(municipios, start_date, end_date)
         
-        if len(dff) == 0:
+        if agregados['total'] == 0:
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado para os filtros selecionados", showarrow=False, font=dict(size=14))
             return fig
         
-        dff_limpo = dff.dropna(subset=['idade'])
-        dff_limpo = dff_limpo[dff_limpo['idade'] >= 0]
+        idades = agregados['por_idade']
+        idades = idades[idades.index >= 0]
         
-        if len(dff_limpo) == 0:
+        if len(idades) == 0:
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado de idade valido", showarrow=False, font=dict(size=14))
             return fig
         
-        counts = dff_limpo.groupby(pd.cut(dff_limpo['idade'], bins=10), observed=True).size().reset_index(name='casos')
+        # pd.cut sobre as idades distintas gera as mesmas faixas que sobre as linhas
+        faixas = pd.cut(pd.Series(idades.index.to_numpy(), name='idade'), bins=10)
+        counts = idades.groupby(faixas.to_numpy(), observed=True).sum().rename_axis('idade').reset_index(name='casos')
         counts['faixa_etaria'] = counts['idade'].apply(lambda x: f"{int(x.left)}-{int(x.right)}")
         
         fig = px.bar(counts, x='faixa_etaria', y='casos',
@@ -438,29 +1841,22 @@ def casos_idade(municipios, start_date, end_date):
 )
 def secao_sintomas(municipios, start_date, end_date):
     try:
-        if df.empty or 'sintomas' not in df.columns:
+        if consultas.sem_dados() or not consultas.tem_coluna('sintomas'):
             return html.Div()
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        agregados = calcular_agregados(municipios, start_date, end_date)
         
-        if len(dff) == 0:
+        if agregados['total'] == 0:
             return html.Div()
         
-        # Fazer split dos sintomas multivalorados (separados por vírgula)
-        sintomas_individuais = []
-        for sintomas_str in dff['sintomas'].dropna():
-            sintomas_str = str(sintomas_str).strip()
-            if sintomas_str and sintomas_str.upper() != 'NÃO INFORMADO':
-                # Split por vírgula e adicionar cada sintoma individual
-                sintomas_lista = [s.strip() for s in sintomas_str.split(',') if s.strip()]
-                sintomas_individuais.extend(sintomas_lista)
+        # frequência de cada sintoma individual (contada na matriz de bits)
+        sintomas_series = agregados['sintomas']
+        sintomas_series = sintomas_series[sintomas_series > 0]
         
-        if not sintomas_individuais:
+        if sintomas_series.empty:
             return html.Div()
         
-        # Contar frequência de cada sintoma individual
-        sintomas_series = pd.Series(sintomas_individuais)
-        sintomas_counts = sintomas_series.value_counts().nlargest(15).reset_index()
+        sintomas_counts = sintomas_series.sort_values(ascending=False, kind='stable').nlargest(15).reset_index()
         sintomas_counts.columns = ['sintomas','count']
         
         fig = px.bar(sintomas_counts, y='sintomas', x='count', orientation='h',
@@ -481,20 +1877,49 @@ def secao_sintomas(municipios, start_date, end_date):
         print(f"erro em secao_sintomas: {e}")
         return html.Div()
 
+def agregar_grade(lat, lon, zoom):
+    # celulas quadradas com o lado (em graus) de MAPA_RAIO pixels no zoom dado;
+    # devolve o centro de cada celula ocupada e o numero de pontos nela
+    tamanho = MAPA_RAIO * 360 / (256 * 2 ** zoom)
+    linha = np.floor(lat / tamanho).astype(np.int64)
+    coluna = np.floor(lon / tamanho).astype(np.int64)
+    celulas, contagem = np.unique(np.stack([linha, coluna], axis=1), axis=0, return_counts=True)
+    return pd.DataFrame({
+        'latitude': (celulas[:, 0] + 0.5) * tamanho,
+        'longitude': (celulas[:, 1] + 0.5) * tamanho,
+        'notificacoes': contagem,
+    })
+
+def vista_mapa(relayout=None):
+    # centro e zoom atuais do mapa, para manter a vista do usuario ao redesenhar.
+    # o zoom e inteiro e o centro vai para uma grade de um quarto de tile nesse
+    # zoom: a figura (e a chave dela no cache) so muda quando a vista muda de fato
+    zoom = MAPA_ZOOM
+    if relayout:
+        zoom = relayout.get('mapbox.zoom', zoom)
+    zoom = min(max(int(round(zoom)), 0), 20)
+    if not relayout or 'mapbox.center' not in relayout:
+        return MAPA_CENTRO, zoom
+    passo = 90 / 2 ** zoom
+    centro = {eixo: round(round(float(relayout['mapbox.center'][eixo]) / passo) * passo, 6) for eixo in ('lat', 'lon')}
+    return centro, zoom
+
 @app.callback(
     Output('map-notificacoes','figure'),
     [Input('municipio-select','value'), 
      Input('date-range','start_date'), 
-     Input('date-range','end_date')]
+     Input('date-range','end_date'),
+     Input('map-notificacoes','relayoutData')]
 )
-def map_notificacoes(municipios, start_date, end_date):
+@cache_figura('map-notificacoes', chave_extras=vista_mapa)
+def map_notificacoes(municipios, start_date, end_date, relayout=None):
     try:
-        if df.empty:
+        if consultas.sem_dados():
             fig = go.Figure()
             fig.add_annotation(text="nenhum dado disponivel", showarrow=False, font=dict(size=20))
             return fig
         
-        dff = filter_dataframe(municipios, start_date, end_date)
+        dff = filter_dataframe(municipios, start_date, end_date, colunas=COLUNAS_GRAFICOS['map-notificacoes'])
         
         if len(dff) == 0:
             fig = go.Figure()
@@ -504,18 +1929,31 @@ def map_notificacoes(municipios, start_date, end_date):
         if 'longitude' in dff.columns and 'latitude' in dff.columns:
             dff_map = dff.dropna(subset=['longitude','latitude'])
             if len(dff_map) > 0:
-                fig = px.density_mapbox(dff_map, lat='latitude', lon='longitude',
-                                       radius=10,
-                                       center=dict(lat=-1.4558, lon=-48.5044),
-                                       zoom=5,
-                                       mapbox_style='open-street-map',
-                                       title='mapa de densidade de notificacoes',
-                                       color_continuous_scale='reds')
-                fig.update_layout(title_x=0.5)
+                centro, zoom = vista_mapa(relayout)
+                if MAPA_AGREGADO:
+                    grade = agregar_grade(dff_map['latitude'].to_numpy(dtype='float64'),
+                                          dff_map['longitude'].to_numpy(dtype='float64'), zoom)
+                    fig = px.density_mapbox(grade, lat='latitude', lon='longitude', z='notificacoes',
+                                           radius=MAPA_RAIO,
+                                           center=centro,
+                                           zoom=zoom,
+                                           mapbox_style='open-street-map',
+                                           title='mapa de densidade de notificacoes',
+                                           color_continuous_scale='reds')
+                else:
+                    fig = px.density_mapbox(dff_map, lat='latitude', lon='longitude',
+                                           radius=MAPA_RAIO,
+                                           center=centro,
+                                           zoom=zoom,
+                                           mapbox_style='open-street-map',
+                                           title='mapa de densidade de notificacoes',
+                                           color_continuous_scale='reds')
+                # uirevision fixo evita que o mapa volte a vista inicial a cada filtro
+                fig.update_layout(title_x=0.5, uirevision='mapa')
                 return fig
         
         if 'municipio' in dff.columns:
-            agg = dff.groupby('municipio').size().reset_index(name='count').nlargest(30, 'count')
+            agg = calcular_agregados(municipios, start_date, end_date)['por_municipio'].nlargest(30, 'count')
             fig = px.bar(agg, y='municipio', x='count', orientation='h',
                         title='top 30 municipios por notificacoes',
                         color='count',
@@ -537,5 +1975,8 @@ def map_notificacoes(municipios, start_date, end_date):
         fig.add_annotation(text=f"erro: {str(e)}", showarrow=False, font=dict(size=14))
         return fig
 
+if DIR_DADOS and isinstance(consultas, ConsultasPandas):
+    threading.Thread(target=vigiar_diretorio, args=(DIR_DADOS, INTERVALO_RECARGA), daemon=True).start()
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
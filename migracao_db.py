@@ -1,10 +1,15 @@
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
 import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import io
 import os
+import time
+
+from recorte_parquet import filtros_parquet
 
 load_dotenv()
 DB_CONFIG = {
@@ -12,7 +17,7 @@ DB_CONFIG = {
     'database': os.getenv('PG_DB'),
     'user': os.getenv('PG_USER'),
     'password': os.getenv('PG_PASSWORD'),
-    'port': int(os.getenv('PG_PORT'))
+    'port': int(os.getenv('PG_PORT', '5432'))
 }
 
 # Mapeamentos de valores do CSV para o banco de dados
@@ -95,12 +100,154 @@ MAPEAMENTOS = {
     }
 }
 
+# Colunas criadas apenas para particionar o dataset (ver particionar_parquet.py)
+COLUNAS_SO_PARTICAO = ['ano_mes']
+
+# Linhas enviadas por COPY em cada lote (um commit por lote)
+LOTE_COPY = 50000
+
+# Modo streaming: lê e migra o parquet em lotes desse tamanho em vez de carregá-lo inteiro
+LINHAS_POR_LOTE = int(os.getenv('MIGRACAO_LINHAS_POR_LOTE')) if os.getenv('MIGRACAO_LINHAS_POR_LOTE') else None
+
+# Cargas da fase 5 rodam em paralelo, cada uma em conexão própria (no mínimo um
+# worker: com 0 o ThreadPoolExecutor falharia só na fase 5, com as fases 1-4 já gravadas)
+WORKERS_FASE5 = max(1, int(os.getenv('MIGRACAO_WORKERS', str(min(7, os.cpu_count() or 1)))))
+
+# (método, cargas que precisam terminar antes). dados_clinicos é validado por
+# trigger contra notificacao_sintoma/notificacao_condicao já gravadas
+CARGAS_FASE5 = [
+    ('migrar_residencia_paciente', []),
+    ('migrar_notificacao_sintoma', []),
+    ('migrar_notificacao_condicao', []),
+    ('migrar_notificacao_vacina', []),
+    ('migrar_teste_laboratorial', []),
+    ('migrar_dados_estrategia_local', []),
+    ('migrar_dados_clinicos', ['migrar_notificacao_sintoma', 'migrar_notificacao_condicao']),
+]
+
+COLUNAS_NOTIFICACAO = ['notificacao_id', 'paciente_id', 'municipio_notificacao_id', 'cbo_id',
+                       'profissional_saude', 'profissional_seguranca', 'data_notificacao',
+                       'origem', 'excluido', 'validado']
+
+def valor_copy(valor):
+    """Formata um valor para o formato texto do COPY"""
+    if valor is None or valor is pd.NaT:
+        return '\\N'
+    if isinstance(valor, (bool, np.bool_)):
+        return 't' if valor else 'f'
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return valor.isoformat()
+    return (str(valor).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def ler_parquet(arquivo_parquet, inicio=None, fim=None, municipios=None, estados=None):
+    """Lê um parquet ou um diretório particionado (hive), só com as partes do recorte"""
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    dataset = ds.dataset(arquivo_parquet, format='parquet', partitioning='hive')
+    filtros = filtros_parquet(dataset.schema.names, inicio, fim, municipios, estados)
+    tabela = dataset.to_table(filter=pq.filters_to_expression(filtros) if filtros else None)
+    df = tabela.to_pandas()
+    return df.drop(columns=[c for c in COLUNAS_SO_PARTICAO if c in df.columns])
+
+# ============= TRANSFORMAÇÕES VETORIZADAS =============
+# Cada função recebe uma coluna inteira do DataFrame e devolve a coluna de destino
+
+VALORES_VERDADEIROS = ['TRUE', 'VERDADEIRO', 'SIM']
+VALORES_FALSOS = ['FALSE', 'FALSO', 'NÃO', 'NAO']
+
+def normalizar(serie):
+    """Equivale a str(valor).strip().upper(), mantendo os nulos"""
+    return serie.astype('string').str.strip().str.upper()
+
+def booleano(serie, padrao):
+    """TRUE/VERDADEIRO/SIM → True, FALSE/FALSO/NÃO/NAO → False, demais → padrao"""
+    texto = normalizar(serie)
+    return pd.Series(
+        np.select([texto.isin(VALORES_VERDADEIROS), texto.isin(VALORES_FALSOS)], [True, False], padrao),
+        index=serie.index, dtype=object
+    )
+
+def texto_opcional(serie):
+    """Texto sem espaços nas pontas; nulo quando ausente ou 'NÃO INFORMADO'"""
+    texto = serie.astype('string').str.strip()
+    return texto.where(texto.str.upper() != 'NÃO INFORMADO')
+
+def inteiro_opcional(serie):
+    """Equivale a int(valor) nos valores presentes"""
+    return np.trunc(serie).astype('Int64')
+
+def buscar_ids(chaves, cache):
+    """Busca cada linha das colunas-chave em um dict indexado por tuplas"""
+    ids = pd.array(list(cache.values()) + [None], dtype='Int64')
+    if not cache:
+        return pd.Series(ids[[-1] * len(chaves[0])], index=chaves[0].index)
+    posicoes = pd.MultiIndex.from_tuples(list(cache)).get_indexer(pd.MultiIndex.from_arrays(chaves))
+    return pd.Series(ids[posicoes], index=chaves[0].index)
+
+def valores(serie):
+    """Valores Python prontos para o banco, com None nos nulos"""
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+def linhas_prontas(tabela):
+    """Transpõe as colunas já transformadas em tuplas para inserção"""
+    return list(zip(*(valores(tabela[coluna]) for coluna in tabela.columns)))
+
+def ler_lotes(arquivo_parquet, linhas_por_lote, inicio=None, fim=None, municipios=None, estados=None):
+    """Lê o parquet em lotes de linhas_por_lote linhas (o último pode ter menos); o índice
+    de cada lote continua a numeração dos anteriores, como se o arquivo tivesse sido lido inteiro"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    dataset = ds.dataset(arquivo_parquet, format='parquet', partitioning='hive')
+    filtros = filtros_parquet(dataset.schema.names, inicio, fim, municipios, estados)
+    
+    def montar(tabela, posicao):
+        df = tabela.to_pandas()
+        df.index = pd.RangeIndex(posicao, posicao + len(df))
+        return df.drop(columns=[c for c in COLUNAS_SO_PARTICAO if c in df.columns])
+    
+    # O filtro deixa batches pequenos (um por row group); junta até completar o lote
+    # e passa as linhas que sobram para o seguinte
+    pendentes, linhas, posicao = [], 0, 0
+    for batch in dataset.to_batches(filter=pq.filters_to_expression(filtros) if filtros else None,
+                                    batch_size=linhas_por_lote):
+        pendentes.append(batch)
+        linhas += batch.num_rows
+        if linhas >= linhas_por_lote:
+            tabela = pa.Table.from_batches(pendentes)
+            while tabela.num_rows >= linhas_por_lote:
+                yield montar(tabela.slice(0, linhas_por_lote), posicao)
+                tabela, posicao = tabela.slice(linhas_por_lote), posicao + linhas_por_lote
+            pendentes, linhas = tabela.to_batches(), tabela.num_rows
+    if linhas:
+        yield montar(pa.Table.from_batches(pendentes), posicao)
+
 class MigradorDadosSUS:
-    def __init__(self, arquivo_parquet, db_config):
-        self.df = pd.read_parquet(arquivo_parquet)
+    def __init__(self, arquivo_parquet, db_config, inicio=None, fim=None, municipios=None, estados=None,
+                 linhas_por_lote=None):
+        # Com linhas_por_lote o DataFrame não fica em memória: cada fase percorre o
+        # parquet lote a lote e só os mapas das tabelas de domínio ficam residentes
+        self.arquivo_parquet = arquivo_parquet
+        self.recorte = (inicio, fim, municipios, estados)
+        self.linhas_por_lote = linhas_por_lote
+        self.df = None if linhas_por_lote else ler_parquet(arquivo_parquet, *self.recorte)
         self.db_config = db_config
         self.conn = None
         self.cursor = None
+    
+    def lotes(self):
+        """Percorre os dados da migração, atribuindo cada lote a self.df"""
+        if not self.linhas_por_lote:
+            yield self.df
+            return
+        for lote in ler_lotes(self.arquivo_parquet, self.linhas_por_lote, *self.recorte):
+            if lote.empty:
+                continue
+            self.df = lote
+            print(f"\n>>> Lote: linhas {lote.index[0]} a {lote.index[-1]}")
+            yield lote
+        self.df = None
         
     def conectar(self):
        
@@ -120,6 +267,23 @@ class MigradorDadosSUS:
             self.conn.close()
         print("✓ Conexão fechada")
     
+    def reservar_ids(self, tabela, coluna, quantidade):
+        """Reserva ids da sequência da tabela, em ordem crescente"""
+        self.cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s) ORDER BY 1",
+            (tabela, coluna, quantidade)
+        )
+        return [id for (id,) in self.cursor.fetchall()]
+    
+    def copiar_lote(self, tabela, colunas, linhas):
+        """Envia um lote de linhas com COPY ... FROM STDIN"""
+        buffer = io.StringIO()
+        for linha in linhas:
+            buffer.write('\t'.join(valor_copy(valor) for valor in linha))
+            buffer.write('\n')
+        buffer.seek(0)
+        self.cursor.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN", buffer)
+    
     def mapear_valor(self, categoria, valor):
         """Mapeia valores do CSV para os valores esperados pelo banco"""
         if pd.isna(valor):
@@ -218,13 +382,16 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT COUNT(*) FROM classificacao_final")
         print(f"✓ Classificação Final: {self.cursor.fetchone()[0]} registros inseridos")
     
-    def migrar_sintomas(self):
+    def migrar_sintomas(self, valores_sintomas=None):
         """Migra tabela sintoma - 'Outros' deve ser o 10º (sintoma_id = 10)"""
         print("\n--- Migrando SINTOMAS ---")
         
+        if valores_sintomas is None:
+            valores_sintomas = self.df['sintomas'].dropna().unique()
+        
         # Campo sintomas contém múltiplos sintomas separados por vírgula
         todos_sintomas = []
-        for sintomas_str in self.df['sintomas'].dropna().unique():
+        for sintomas_str in valores_sintomas:
             if pd.notna(sintomas_str):
                 sintomas_lista = [s.strip() for s in str(sintomas_str).split(',')]
                 todos_sintomas.extend(sintomas_lista)
@@ -256,17 +423,20 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT COUNT(*) FROM sintoma")
         print(f"✓ Sintomas: {self.cursor.fetchone()[0]} registros inseridos (Outros = 10º)")
     
-    def migrar_condicoes(self):
+    def migrar_condicoes(self, valores_condicoes=None):
         """Migra tabela condicao - 'Outros' deve ser o 9º (condicao_id = 9)"""
         print("\n--- Migrando CONDIÇÕES ---")
         
+        if valores_condicoes is None:
+            valores_condicoes = self.df['condicoes'].dropna().unique()
+        
         # Campo condicoes contém múltiplas condições separadas por vírgula
         # MAS algumas condições têm vírgulas internas (ex: "GRAUS 3, 4 OU 5")
         # Usar lista de condições válidas do mapeamento
         condicoes_validas = list(MAPEAMENTOS['condicao'].keys())
         
         todas_condicoes = set()
-        for condicoes_str in self.df['condicoes'].dropna().unique():
+        for condicoes_str in valores_condicoes:
             if pd.notna(condicoes_str):
                 condicoes_str_upper = str(condicoes_str).upper()
                 # Encontrar condições válidas na string
@@ -496,16 +666,23 @@ class MigradorDadosSUS:
         try:
             self.conectar()
             
-            self.migrar_sexo()
-            self.migrar_raca()
-            self.migrar_evolucao_caso()
-            self.migrar_classificacao_final()
-            self.migrar_sintomas()
-            self.migrar_condicoes()
-            self.migrar_estado()
-            self.migrar_cbo()
-            self.migrar_laboratorio_vacina()
-            self.migrar_fabricante_teste()
+            # Todas as cargas de domínio usam ON CONFLICT: podem rodar lote a lote.
+            # Sintomas e condições não: a posição de 'Outros' (id 10/9, usada pelos
+            # triggers) depende da lista completa, então os valores são juntados antes
+            valores_sintomas, valores_condicoes = set(), set()
+            for _ in self.lotes():
+                self.migrar_sexo()
+                self.migrar_raca()
+                self.migrar_evolucao_caso()
+                self.migrar_classificacao_final()
+                valores_sintomas.update(self.df['sintomas'].dropna().unique())
+                valores_condicoes.update(self.df['condicoes'].dropna().unique())
+                self.migrar_estado()
+                self.migrar_cbo()
+                self.migrar_laboratorio_vacina()
+                self.migrar_fabricante_teste()
+            self.migrar_sintomas(valores_sintomas)
+            self.migrar_condicoes(valores_condicoes)
             self.migrar_tabelas_codigo()
             
             print("\n" + "="*60)
@@ -591,6 +768,10 @@ class MigradorDadosSUS:
         df_pacientes = self.df[['idade', 'sexo', 'racaCor', 'codigoContemComunidadeTradicional']].copy()
         df_pacientes = df_pacientes.drop_duplicates()
         
+        # Pacientes já gravados (por um lote anterior, por exemplo) não são duplicados
+        self.cursor.execute("SELECT idade, sexo_id, raca_id, membro_povo_tradicional FROM paciente")
+        pacientes_existentes = set(self.cursor.fetchall())
+        
         pacientes_inseridos = 0
         pacientes_erro = 0
         
@@ -610,12 +791,17 @@ class MigradorDadosSUS:
                 pacientes_erro += 1
                 continue
             
+            paciente_key = (idade, sexo_id, raca_id, membro_povo_tradicional)
+            if paciente_key in pacientes_existentes:
+                continue
+            
             try:
                 self.cursor.execute(
                     """INSERT INTO paciente (idade, sexo_id, raca_id, membro_povo_tradicional) 
                        VALUES (%s, %s, %s, %s)""",
-                    (idade, sexo_id, raca_id, membro_povo_tradicional)
+                    paciente_key
                 )
+                pacientes_existentes.add(paciente_key)
                 pacientes_inseridos += 1
                 
             except Exception as e:
@@ -632,6 +818,17 @@ class MigradorDadosSUS:
     
     # ============= FASE 4: NÚCLEO CENTRAL =============
     
+    def preparar_origem(self):
+        """Cria (ou esvazia) a tabela que liga cada linha do parquet à notificação gerada"""
+        self.cursor.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS migracao_origem (
+                linha_origem BIGINT PRIMARY KEY,
+                notificacao_id INT NOT NULL REFERENCES notificacao (notificacao_id) ON DELETE CASCADE
+            )
+        """)
+        self.cursor.execute("TRUNCATE migracao_origem")
+        self.conn.commit()
+    
     def migrar_notificacao(self):
         """Migra tabela notificacao (depende de paciente, municipio, cbo)"""
         print("\n--- Migrando NOTIFICAÇÕES ---")
@@ -670,120 +867,147 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT raca_id, descricao FROM raca")
         raca_map = {desc.upper(): raca_id for raca_id, desc in self.cursor.fetchall()}
         
-        notificacoes_inseridas = 0
-        notificacoes_erro = 0
-        
+        # Todas as colunas de destino são calculadas de uma vez sobre o DataFrame inteiro
+        print("  Preparando notificações...")
+        df = self.df
+        
+        # Buscar paciente_id pela combinação (idade, sexo, raça, comunidade tradicional)
+        membro_trad = df['codigoContemComunidadeTradicional']
+        paciente_id = buscar_ids([
+            np.trunc(df['idade']),
+            normalizar(df['sexo']).map(sexo_map).astype('Int64'),
+            normalizar(df['racaCor']).map(raca_map).astype('Int64'),
+            membro_trad.where(membro_trad.notna(), False),
+        ], pacientes_cache)
+        
+        # Buscar municipio_id de notificação
+        municipio_id = buscar_ids(
+            [normalizar(df['municipioNotificacao']), normalizar(df['estadoNotificacao'])], municipios_cache
+        )
+        
+        profissional_saude = booleano(df['profissionalSaude'], False)
+        
+        # CBO: código antes de ' - ' com zeros à esquerda - obrigatório se profissional_saude = TRUE
+        cbo = df['cbo'].astype('string').str.strip()
+        com_codigo = (cbo.str.contains(' - ', regex=False) & (cbo.str.lower() != 'não informado')).fillna(False)
+        cbo_id = cbo.str.split(' - ').str[0].str.strip().str.zfill(6).where(com_codigo).map(cbo_map).astype('Int64')
+        
+        # VALIDAR CONSTRAINT: profissional_saude = TRUE exige cbo_id NOT NULL
+        # profissional_saude = FALSE exige cbo_id NULL
+        eh_profissional = profissional_saude.astype(bool)
+        sem_cbo = eh_profissional & cbo_id.isna()
+        cbo_id = cbo_id.where(eh_profissional)
+        
+        validos = paciente_id.notna() & municipio_id.notna() & ~sem_cbo & df['dataNotificacao'].notna()
+        notificacoes_erro = int((~validos).sum())
+        
+        linhas = linhas_prontas(pd.DataFrame({
+            'linha': df.index,
+            'paciente_id': paciente_id,
+            'municipio_id': municipio_id,
+            'cbo_id': cbo_id,
+            'profissional_saude': profissional_saude,
+            'profissional_seguranca': booleano(df['profissionalSeguranca'], None),
+            'data_notificacao': df['dataNotificacao'],
+            'origem': texto_opcional(df['origem']),
+            'excluido': df['excluido'],
+            'validado': booleano(df['validado'], None),
+        })[validos])
+        
+        # Ids reservados antes do COPY: a ordem das linhas define os ids, como no INSERT linha a linha
         print("  Inserindo notificações...")
-        for idx, row in self.df.iterrows():
-            # Buscar paciente_id
-            idade = int(row['idade']) if pd.notna(row['idade']) else None
-            sexo_id = sexo_map.get(str(row['sexo']).strip().upper())
-            raca_id = raca_map.get(str(row['racaCor']).strip().upper())
-            membro_trad = row['codigoContemComunidadeTradicional'] if pd.notna(row['codigoContemComunidadeTradicional']) else False
-            
-            paciente_key = (idade, sexo_id, raca_id, membro_trad)
-            paciente_id = pacientes_cache.get(paciente_key)
-            
-            if not paciente_id:
-                notificacoes_erro += 1
-                continue
-            
-            # Buscar municipio_id de notificação
-            mun_not_nome = str(row['municipioNotificacao']).strip().upper()
-            est_not_nome = str(row['estadoNotificacao']).strip().upper()
-            municipio_key = (mun_not_nome, est_not_nome)
-            municipio_id = municipios_cache.get(municipio_key)
-            
-            if not municipio_id:
-                notificacoes_erro += 1
-                continue
-            
-            # Processar profissional_saude PRIMEIRO (necessário para validar CBO)
-            prof_saude_str = str(row['profissionalSaude']).strip().upper()
-            if prof_saude_str in ['TRUE', 'VERDADEIRO', 'SIM']:
-                profissional_saude = True
-            elif prof_saude_str in ['FALSE', 'FALSO', 'NÃO', 'NAO']:
-                profissional_saude = False
-            else:
-                profissional_saude = False  # Default
-            
-            # Buscar CBO (opcional) - MAS obrigatório se profissional_saude = TRUE
-            cbo_str = str(row['cbo']).strip()
-            cbo_id = None
-            if cbo_str and cbo_str.lower() != 'não informado' and ' - ' in cbo_str:
-                codigo_cbo = cbo_str.split(' - ')[0].strip().zfill(6)
-                cbo_id = cbo_map.get(codigo_cbo)
-            
-            # VALIDAR CONSTRAINT: profissional_saude = TRUE exige cbo_id NOT NULL
-            # profissional_saude = FALSE exige cbo_id NULL
-            if profissional_saude and not cbo_id:
-                # Profissional de saúde mas sem CBO válido - pular registro
-                notificacoes_erro += 1
-                continue
-            elif not profissional_saude:
-                # Não é profissional de saúde - forçar cbo_id = NULL
-                cbo_id = None
-            
-            # Processar profissional_seguranca
-            prof_seg_str = str(row['profissionalSeguranca']).strip().upper()
-            if prof_seg_str in ['TRUE', 'VERDADEIRO', 'SIM']:
-                profissional_seguranca = True
-            elif prof_seg_str in ['FALSE', 'FALSO', 'NÃO', 'NAO']:
-                profissional_seguranca = False
-            else:
-                profissional_seguranca = None
-            
-            # Data de notificação
-            data_notificacao = row['dataNotificacao']
-            if pd.isna(data_notificacao):
-                notificacoes_erro += 1
-                continue
-            
-            # Origem
-            origem = str(row['origem']).strip() if pd.notna(row['origem']) and str(row['origem']).strip().upper() != 'NÃO INFORMADO' else None
-            
-            # Excluído e Validado
-            excluido = row['excluido'] if pd.notna(row['excluido']) else None
-            
-            validado_str = str(row['validado']).strip().upper()
-            if validado_str in ['TRUE', 'VERDADEIRO', 'SIM']:
-                validado = True
-            elif validado_str in ['FALSE', 'FALSO', 'NÃO', 'NAO']:
-                validado = False
-            else:
-                validado = None
-            
+        inseridas = 0
+        for inicio in range(0, len(linhas), LOTE_COPY):
+            lote = linhas[inicio:inicio + LOTE_COPY]
+            ids = self.reservar_ids('notificacao', 'notificacao_id', len(lote))
+            valores = [(notificacao_id,) + linha[1:] for notificacao_id, linha in zip(ids, lote)]
             try:
-                self.cursor.execute(
-                    """INSERT INTO notificacao (paciente_id, municipio_notificacao_id, cbo_id, 
-                       profissional_saude, profissional_seguranca, data_notificacao, origem, excluido, validado)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                       RETURNING notificacao_id""",
-                    (paciente_id, municipio_id, cbo_id, profissional_saude, profissional_seguranca,
-                     data_notificacao, origem, excluido, validado)
-                )
-                notificacoes_inseridas += 1
-                
-                # Commit a cada 1000 registros
-                if notificacoes_inseridas % 1000 == 0:
-                    self.conn.commit()
-                    print(f"  → {notificacoes_inseridas} notificações inseridas...")
-                    
+                self.copiar_lote('notificacao', COLUNAS_NOTIFICACAO, valores)
+                self.copiar_lote('migracao_origem', ['linha_origem', 'notificacao_id'],
+                                 [(linha[0], notificacao_id) for linha, notificacao_id in zip(lote, ids)])
+                self.conn.commit()
+                inseridas += len(lote)
             except Exception as e:
-                print(f"  ✗ Erro ao inserir notificação (linha {idx}): {e}")
-                notificacoes_erro += 1
-                
-                if notificacoes_erro > 50:
-                    print("  ⚠ Muitos erros, parando inserção")
-                    break
+                # Um registro inválido derruba o lote inteiro: refaz linha a linha com os mesmos ids
+                self.conn.rollback()
+                print(f"  ⚠ COPY do lote falhou ({e}), inserindo linha a linha")
+                for linha, valor in zip(lote, valores):
+                    try:
+                        self.cursor.execute(
+                            f"INSERT INTO notificacao ({', '.join(COLUNAS_NOTIFICACAO)}) "
+                            f"VALUES ({', '.join(['%s'] * len(COLUNAS_NOTIFICACAO))})",
+                            valor
+                        )
+                        self.cursor.execute(
+                            "INSERT INTO migracao_origem (linha_origem, notificacao_id) VALUES (%s, %s)",
+                            (linha[0], valor[0])
+                        )
+                        self.conn.commit()
+                        inseridas += 1
+                    except Exception as e:
+                        self.conn.rollback()
+                        print(f"  ✗ Erro ao inserir notificação (linha {linha[0]}): {e}")
+                        notificacoes_erro += 1
+            print(f"  → {inseridas} notificações inseridas...")
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM notificacao")
         print(f"✓ Notificações: {self.cursor.fetchone()[0]} registros inseridos ({notificacoes_erro} erros)")
     
     # ============= FASE 5: TABELAS DEPENDENTES DE NOTIFICAÇÃO =============
     
-    def migrar_residencia_paciente(self, notificacao_paciente_map):
+    def com_notificacao(self, linhas_origem):
+        """Máscara das linhas do DataFrame que viraram notificação"""
+        return pd.Series(self.df.index.isin(linhas_origem), index=self.df.index)
+    
+    def inserir_por_origem(self, tabela, dados, rotulo, chave='notificacao_id', conflito=''):
+        """Grava as linhas transformadas (coluna 'linha' + colunas da tabela) trocando a
+        linha de origem pela notificação com JOIN em migracao_origem; retorna os erros"""
+        colunas = list(dados.columns[1:])
+        linhas = linhas_prontas(dados)
+        if not linhas:
+            return 0
+        
+        # chave = paciente_id: o paciente vem da própria notificação
+        juncao = "JOIN migracao_origem o ON o.linha_origem = s.linha"
+        valor_chave = "o.notificacao_id"
+        if chave == 'paciente_id':
+            juncao += " JOIN notificacao n ON n.notificacao_id = o.notificacao_id"
+            valor_chave = "n.paciente_id"
+        
+        self.cursor.execute(
+            f"""CREATE TEMP TABLE staging_{tabela} ON COMMIT DROP AS
+                SELECT 0::bigint AS ordem, 0::bigint AS linha, {', '.join(colunas)} FROM {tabela} WITH NO DATA"""
+        )
+        self.copiar_lote(f'staging_{tabela}', ['ordem', 'linha'] + colunas,
+                         [(ordem,) + linha for ordem, linha in enumerate(linhas)])
+        self.cursor.execute(f"CREATE INDEX ON staging_{tabela} (ordem)")
+        sql = f"""INSERT INTO {tabela} ({chave}, {', '.join(colunas)})
+                  SELECT {valor_chave}, {', '.join('s.' + c for c in colunas)}
+                  FROM staging_{tabela} s {juncao}
+                  WHERE s.ordem >= %s AND s.ordem < %s
+                  ORDER BY s.ordem {conflito}"""
+        
+        def inserir(inicio, fim):
+            # Tenta o intervalo inteiro; se o banco recusar alguma linha, divide ao meio
+            # até isolar as linhas com erro, descartando só elas
+            self.cursor.execute(f"SAVEPOINT parte_{inicio}_{fim}")
+            try:
+                self.cursor.execute(sql, (inicio, fim))
+                self.cursor.execute(f"RELEASE SAVEPOINT parte_{inicio}_{fim}")
+                return 0
+            except psycopg2.Error as e:
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT parte_{inicio}_{fim}")
+                if fim - inicio == 1:
+                    print(f"  ✗ Erro ao inserir {rotulo} (linha {linhas[inicio][0]}): {e}")
+                    return 1
+            meio = (inicio + fim) // 2
+            return inserir(inicio, meio) + inserir(meio, fim)
+        
+        erros = inserir(0, len(linhas))
+        self.conn.commit()
+        return erros
+    
+    def migrar_residencia_paciente(self, linhas_origem):
         """Migra tabela residencia_paciente (relação paciente-município de residência)"""
         print("\n--- Migrando RESIDÊNCIA PACIENTE ---")
         
@@ -798,51 +1022,34 @@ class MigradorDadosSUS:
             key = (mun_nome.upper(), est_nome.upper())
             municipios_cache[key] = mun_id
         
-        residencias_inseridas = 0
-        residencias_erro = 0
-        residencias_vistas = set()
+        # Buscar município de residência; o paciente vem da notificação da linha
+        df = self.df
+        com_notificacao = self.com_notificacao(linhas_origem)
+        municipio_id = buscar_ids([normalizar(df['municipio']), normalizar(df['estado'])], municipios_cache)
+        residencias_erro = int((com_notificacao & municipio_id.isna()).sum())
         
-        for idx, row in self.df.iterrows():
-            # Buscar município de residência
-            mun_res_nome = str(row['municipio']).strip().upper()
-            est_res_nome = str(row['estado']).strip().upper()
-            municipio_key = (mun_res_nome, est_res_nome)
-            municipio_id = municipios_cache.get(municipio_key)
-            
-            # Buscar paciente_id via notificação
-            if idx not in notificacao_paciente_map:
-                continue
-            
-            paciente_id = notificacao_paciente_map[idx]
-            
-            if not municipio_id or not paciente_id:
-                residencias_erro += 1
-                continue
-            
-            # Evitar duplicatas (mesma combinação paciente-município)
-            key = (paciente_id, municipio_id)
-            if key in residencias_vistas:
-                continue
-            residencias_vistas.add(key)
-            
-            try:
-                self.cursor.execute(
-                    """INSERT INTO residencia_paciente (paciente_id, municipio_id)
-                       VALUES (%s, %s) ON CONFLICT (paciente_id, municipio_id) DO NOTHING""",
-                    (paciente_id, municipio_id)
-                )
-                if self.cursor.rowcount > 0:
-                    residencias_inseridas += 1
-            except Exception as e:
-                print(f"  ✗ Erro ao inserir residência (linha {idx}): {e}")
-                self.conn.rollback()  # CRITICAL: desfazer transação abortada
-                residencias_erro += 1
+        # Duplicatas (mesma combinação paciente-município) ficam no ON CONFLICT
+        residencias = pd.DataFrame({'linha': df.index, 'municipio_id': municipio_id})
+        residencias_erro += self.inserir_por_origem(
+            'residencia_paciente', residencias[com_notificacao & municipio_id.notna()], 'residência',
+            chave='paciente_id', conflito='ON CONFLICT (paciente_id, municipio_id) DO NOTHING'
+        )
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM residencia_paciente")
-        print(f"✓ Residências: {self.cursor.fetchone()[0]} registros ({residencias_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Residências: {registros} registros ({residencias_erro} erros)")
+        return registros, residencias_erro
+    
+    def mapear_ids(self, categoria, serie, ids):
+        """Mapeia uma coluna para ids do banco, resolvendo cada valor distinto uma única vez"""
+        texto = normalizar(serie)
+        tabela = {}
+        for valor in texto.dropna().unique():
+            mapeado = self.mapear_valor(categoria, valor)
+            tabela[valor] = ids.get(mapeado.upper()) if mapeado else None
+        return texto.map(tabela).astype('Int64')
     
-    def migrar_dados_clinicos(self, notificacao_id_map):
+    def migrar_dados_clinicos(self, linhas_origem):
         """Migra tabela dados_clinicos"""
         print("\n--- Migrando DADOS CLÍNICOS ---")
         
@@ -853,63 +1060,32 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT evolucao_caso_id, descricao FROM evolucao_caso")
         evolucao_map = {desc.upper(): id for id, desc in self.cursor.fetchall()}
         
-        dados_inseridos = 0
-        dados_erro = 0
+        df = self.df
         
-        for idx, row in self.df.iterrows():
-            if idx not in notificacao_id_map:
-                continue
-            
-            notificacao_id = notificacao_id_map[idx]
-            
-            # Data início sintomas (opcional agora)
-            data_inicio_sintomas = row['dataInicioSintomas'] if pd.notna(row['dataInicioSintomas']) else None
-            
-            # Classificação final
-            classif_str = str(row['classificacaoFinal']).strip().upper()
-            classif_mapeado = self.mapear_valor('classificacao_final', classif_str)
-            classificacao_final_id = classif_map.get(classif_mapeado.upper()) if classif_mapeado else None
-            
-            # Evolução caso
-            evolucao_str = str(row['evolucaoCaso']).strip().upper()
-            evolucao_mapeado = self.mapear_valor('evolucao_caso', evolucao_str)
-            evolucao_caso_id = evolucao_map.get(evolucao_mapeado.upper()) if evolucao_mapeado else None
-            
-            # Data encerramento - VALIDAR: deve ser >= data_inicio_sintomas
-            data_encerramento = row['dataEncerramento'] if pd.notna(row['dataEncerramento']) else None
-            
-            # VALIDAR: Se data_encerramento < data_inicio_sintomas → forçar NULL
-            if data_encerramento and data_inicio_sintomas and data_encerramento < data_inicio_sintomas:
-                data_encerramento = None
-            
-            # Especificação outros sintomas/condições
-            espec_outros_sintomas = str(row['outrosSintomas']).strip() if pd.notna(row['outrosSintomas']) and str(row['outrosSintomas']).strip().upper() != 'NÃO INFORMADO' else None
-            espec_outras_condicoes = str(row['outrasCondicoes']).strip() if pd.notna(row['outrasCondicoes']) and str(row['outrasCondicoes']).strip().upper() != 'NÃO INFORMADO' else None
-            
-            # Código recebeu vacina (1, 2, 3)
-            codigo_recebeu_vacina = int(row['codigoRecebeuVacina']) if pd.notna(row['codigoRecebeuVacina']) else None
-            
-            try:
-                self.cursor.execute(
-                    """INSERT INTO dados_clinicos (notificacao_id, data_inicio_sintomas, classificacao_final_id,
-                       evolucao_caso_id, especificacao_outros_sintomas, especificacao_outras_condicoes,
-                       codigo_recebeu_vacina, data_encerramento)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                       ON CONFLICT (notificacao_id) DO NOTHING""",
-                    (notificacao_id, data_inicio_sintomas, classificacao_final_id, evolucao_caso_id,
-                     espec_outros_sintomas, espec_outras_condicoes, codigo_recebeu_vacina, data_encerramento)
-                )
-                dados_inseridos += 1
-            except Exception as e:
-                print(f"  ✗ Erro ao inserir dados clínicos (linha {idx}): {e}")
-                self.conn.rollback()
-                dados_erro += 1
+        # VALIDAR: Se data_encerramento < data_inicio_sintomas → forçar NULL
+        data_encerramento = df['dataEncerramento'].mask(df['dataEncerramento'] < df['dataInicioSintomas'])
+        
+        dados = pd.DataFrame({
+            'linha': df.index,
+            'data_inicio_sintomas': df['dataInicioSintomas'],
+            'classificacao_final_id': self.mapear_ids('classificacao_final', df['classificacaoFinal'], classif_map),
+            'evolucao_caso_id': self.mapear_ids('evolucao_caso', df['evolucaoCaso'], evolucao_map),
+            'especificacao_outros_sintomas': texto_opcional(df['outrosSintomas']),
+            'especificacao_outras_condicoes': texto_opcional(df['outrasCondicoes']),
+            'codigo_recebeu_vacina': inteiro_opcional(df['codigoRecebeuVacina']),
+            'data_encerramento': data_encerramento,
+        })[self.com_notificacao(linhas_origem)]
+        
+        dados_erro = self.inserir_por_origem(
+            'dados_clinicos', dados, 'dados clínicos', conflito='ON CONFLICT (notificacao_id) DO NOTHING'
+        )
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM dados_clinicos")
-        print(f"✓ Dados clínicos: {self.cursor.fetchone()[0]} registros ({dados_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Dados clínicos: {registros} registros ({dados_erro} erros)")
+        return registros, dados_erro
     
-    def migrar_notificacao_sintoma(self, notificacao_id_map):
+    def migrar_notificacao_sintoma(self, linhas_origem):
         """Migra tabela notificacao_sintoma (relação N:N)"""
         print("\n--- Migrando NOTIFICAÇÃO-SINTOMA ---")
         
@@ -917,47 +1093,28 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT sintoma_id, descricao FROM sintoma")
         sintoma_map = {desc.upper(): id for id, desc in self.cursor.fetchall()}
         
-        relacoes_inseridas = 0
-        relacoes_erro = 0
+        sintomas = self.df['sintomas'].astype('string').str.strip()
+        validos = (self.com_notificacao(linhas_origem) & sintomas.notna() & (sintomas != '')
+                   & (sintomas.str.upper() != 'NÃO INFORMADO'))
         
-        for idx, row in self.df.iterrows():
-            if idx not in notificacao_id_map:
-                continue
-            
-            notificacao_id = notificacao_id_map[idx]
-            sintomas_str = str(row['sintomas']).strip()
-            
-            if not sintomas_str or sintomas_str.upper() == 'NÃO INFORMADO':
-                continue
-            
-            # Split por vírgula
-            sintomas_lista = [s.strip() for s in sintomas_str.split(',')]
-            
-            for sintoma_nome in sintomas_lista:
-                sintoma_mapeado = self.mapear_valor('sintoma', sintoma_nome)
-                sintoma_id = sintoma_map.get(sintoma_mapeado.upper()) if sintoma_mapeado else None
-                
-                if not sintoma_id:
-                    continue
-                
-                try:
-                    self.cursor.execute(
-                        """INSERT INTO notificacao_sintoma (notificacao_id, sintoma_id)
-                           VALUES (%s, %s) ON CONFLICT (notificacao_id, sintoma_id) DO NOTHING""",
-                        (notificacao_id, sintoma_id)
-                    )
-                    if self.cursor.rowcount > 0:
-                        relacoes_inseridas += 1
-                except Exception as e:
-                    print(f"  ✗ Erro ao inserir sintoma (linha {idx}): {e}")
-                    self.conn.rollback()
-                    relacoes_erro += 1
+        # Uma linha por sintoma (split por vírgula), na ordem em que aparecem no texto
+        relacoes = pd.DataFrame({
+            'linha': self.df.index,
+            'sintoma_id': sintomas.str.split(','),
+        })[validos.fillna(False)].explode('sintoma_id')
+        relacoes['sintoma_id'] = self.mapear_ids('sintoma', relacoes['sintoma_id'], sintoma_map)
+        
+        relacoes_erro = self.inserir_por_origem(
+            'notificacao_sintoma', relacoes[relacoes['sintoma_id'].notna()], 'sintoma',
+            conflito='ON CONFLICT (notificacao_id, sintoma_id) DO NOTHING'
+        )
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM notificacao_sintoma")
-        print(f"✓ Notificação-Sintoma: {self.cursor.fetchone()[0]} registros ({relacoes_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Notificação-Sintoma: {registros} registros ({relacoes_erro} erros)")
+        return registros, relacoes_erro
     
-    def migrar_notificacao_condicao(self, notificacao_id_map):
+    def migrar_notificacao_condicao(self, linhas_origem):
         """Migra tabela notificacao_condicao (relação N:N)"""
         print("\n--- Migrando NOTIFICAÇÃO-CONDIÇÃO ---")
         
@@ -969,55 +1126,43 @@ class MigradorDadosSUS:
         # para evitar match parcial (ex: "DIABETES" não pode casar com "DIABETES, OUTROS")
         condicoes_validas = sorted(MAPEAMENTOS['condicao'].keys(), key=len, reverse=True)
         
-        relacoes_inseridas = 0
-        relacoes_erro = 0
+        condicoes = normalizar(self.df['condicoes'])
+        validos = (self.com_notificacao(linhas_origem) & condicoes.notna() & (condicoes != '')
+                   & (condicoes != 'NÃO INFORMADO'))
+        restante = condicoes[validos.fillna(False)]
+        
+        # Identificar condições presentes na string usando match de substrings,
+        # removendo cada condição encontrada para evitar duplicatas
+        encontradas = []
+        for ordem, condicao_valida in enumerate(condicoes_validas):
+            contem = restante.str.contains(condicao_valida, regex=False).to_numpy(dtype=bool)
+            condicao_mapeada = self.mapear_valor('condicao', condicao_valida)
+            encontradas.append(pd.DataFrame({
+                'posicao': np.flatnonzero(contem),
+                'ordem': ordem,
+                'linha': restante.index[contem],
+                'condicao_id': condicao_map.get(condicao_mapeada.upper()) if condicao_mapeada else None,
+            }))
+            restante = restante.where(~contem, restante.str.replace(condicao_valida, '', n=1, regex=False))
+        
+        relacoes = pd.concat(encontradas).sort_values(['posicao', 'ordem'], kind='stable')
+        relacoes = relacoes[relacoes['condicao_id'].notna()]
+        relacoes = pd.DataFrame({
+            'linha': relacoes['linha'].to_numpy(),
+            'condicao_id': relacoes['condicao_id'].astype('Int64').to_numpy(),
+        })
+        
+        relacoes_erro = self.inserir_por_origem(
+            'notificacao_condicao', relacoes, 'condição',
+            conflito='ON CONFLICT (notificacao_id, condicao_id) DO NOTHING'
+        )
         
-        for idx, row in self.df.iterrows():
-            if idx not in notificacao_id_map:
-                continue
-            
-            notificacao_id = notificacao_id_map[idx]
-            condicoes_str = str(row['condicoes']).strip().upper()
-            
-            if not condicoes_str or condicoes_str == 'NÃO INFORMADO':
-                continue
-            
-            # Identificar condições presentes na string usando match de substrings
-            condicoes_encontradas = []
-            condicoes_str_temp = condicoes_str
-            
-            for condicao_valida in condicoes_validas:
-                if condicao_valida in condicoes_str_temp:
-                    condicoes_encontradas.append(condicao_valida)
-                    # Remove a condição já encontrada para evitar duplicatas
-                    condicoes_str_temp = condicoes_str_temp.replace(condicao_valida, '', 1)
-            
-            # Inserir cada condição encontrada
-            for condicao_nome in condicoes_encontradas:
-                condicao_mapeada = self.mapear_valor('condicao', condicao_nome)
-                condicao_id = condicao_map.get(condicao_mapeada.upper()) if condicao_mapeada else None
-                
-                if not condicao_id:
-                    continue
-                
-                try:
-                    self.cursor.execute(
-                        """INSERT INTO notificacao_condicao (notificacao_id, condicao_id)
-                           VALUES (%s, %s) ON CONFLICT (notificacao_id, condicao_id) DO NOTHING""",
-                        (notificacao_id, condicao_id)
-                    )
-                    if self.cursor.rowcount > 0:
-                        relacoes_inseridas += 1
-                except Exception as e:
-                    print(f"  ✗ Erro ao inserir condição (linha {idx}): {e}")
-                    self.conn.rollback()
-                    relacoes_erro += 1
-        
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM notificacao_condicao")
-        print(f"✓ Notificação-Condição: {self.cursor.fetchone()[0]} registros ({relacoes_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Notificação-Condição: {registros} registros ({relacoes_erro} erros)")
+        return registros, relacoes_erro
     
-    def migrar_notificacao_vacina(self, notificacao_id_map):
+    def migrar_notificacao_vacina(self, linhas_origem):
         """Migra tabela notificacao_vacina (doses de vacina)"""
         print("\n--- Migrando NOTIFICAÇÃO VACINA ---")
         
@@ -1025,82 +1170,45 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT laboratorio_vacina_id, nome FROM laboratorio_vacina")
         lab_map = {nome.upper(): id for id, nome in self.cursor.fetchall()}
         
-        vacinas_inseridas = 0
-        vacinas_erro = 0
-        
-        for idx, row in self.df.iterrows():
-            if idx not in notificacao_id_map:
-                continue
-            
-            notificacao_id = notificacao_id_map[idx]
-            
-            # Processar codigoDosesVacina (multivalorado: "1,2", "2,3", "1,2,3,4", etc.)
-            codigo_doses = str(row['codigoDosesVacina']).strip()
-            
-            if not codigo_doses or codigo_doses in ['nan', 'None', 'NÃO INFORMADO']:
-                continue
-            
-            # Split para obter lista de doses
-            doses_lista = [int(d.strip()) for d in codigo_doses.split(',') if d.strip().isdigit()]
-            
-            # Mapear doses para campos do dataset
-            # dataPrimeiraDose/dataSegundaDose são ordem cronológica, não número da dose
-            # Vamos inserir baseado na ordem cronológica que temos dados
-            
-            doses_inserir = []
-            
-            # Primeira dose cronológica (se existe data)
-            if pd.notna(row['dataPrimeiraDose']):
-                lab1_nome = str(row['codigoLaboratorioPrimeiraDose']).strip().upper()
-                lab1_id = lab_map.get(lab1_nome) if lab1_nome != 'NÃO INFORMADO' else None
-                lote1 = str(row['lotePrimeiraDose']).strip() if pd.notna(row['lotePrimeiraDose']) and str(row['lotePrimeiraDose']).strip().upper() != 'NÃO INFORMADO' else None
-                
-                # Determinar número da dose: se doses_lista tem valores, usar o primeiro
-                dose_num = doses_lista[0] if doses_lista else 1
-                
-                doses_inserir.append({
-                    'dose_numero': dose_num,
-                    'data_vacinacao': row['dataPrimeiraDose'],
-                    'lab_id': lab1_id,
-                    'lote': lote1
-                })
-            
-            # Segunda dose cronológica (se existe data)
-            if pd.notna(row['dataSegundaDose']):
-                lab2_nome = str(row['codigoLaboratorioSegundaDose']).strip().upper()
-                lab2_id = lab_map.get(lab2_nome) if lab2_nome != 'NÃO INFORMADO' else None
-                lote2 = str(row['loteSegundaDose']).strip() if pd.notna(row['loteSegundaDose']) and str(row['loteSegundaDose']).strip().upper() != 'NÃO INFORMADO' else None
-                
-                # Determinar número da dose: se doses_lista tem 2+ valores, usar o segundo, senão usar 2
-                dose_num = doses_lista[1] if len(doses_lista) > 1 else 2
-                
-                doses_inserir.append({
-                    'dose_numero': dose_num,
-                    'data_vacinacao': row['dataSegundaDose'],
-                    'lab_id': lab2_id,
-                    'lote': lote2
-                })
-            
-            # Inserir cada dose
-            for dose_info in doses_inserir:
-                try:
-                    self.cursor.execute(
-                        """INSERT INTO notificacao_vacina (notificacao_id, dose_numero, data_vacinacao, lab_id, lote)
-                           VALUES (%s, %s, %s, %s, %s)""",
-                        (notificacao_id, dose_info['dose_numero'], dose_info['data_vacinacao'], 
-                         dose_info['lab_id'], dose_info['lote'])
-                    )
-                    vacinas_inseridas += 1
-                except Exception as e:
-                    print(f"  ✗ Erro ao inserir vacina (linha {idx}, dose {dose_info['dose_numero']}): {e}")
-                    self.conn.rollback()
-                    vacinas_erro += 1
+        df = self.df
+        
+        # Processar codigoDosesVacina (multivalorado: "1,2", "2,3", "1,2,3,4", etc.)
+        codigo_doses = df['codigoDosesVacina'].astype('string').str.strip()
+        validos = (self.com_notificacao(linhas_origem) & codigo_doses.notna()
+                   & ~codigo_doses.isin(['', 'nan', 'None', 'NÃO INFORMADO'])).fillna(False)
+        
+        # Números de dose em ordem; só entram os pedaços numéricos
+        numeros = codigo_doses[validos].str.split(',').explode().str.strip()
+        numeros = numeros[numeros.str.isdigit().fillna(False)].astype(int)
+        posicao_numero = numeros.groupby(level=0).cumcount()
+        
+        # dataPrimeiraDose/dataSegundaDose são ordem cronológica, não número da dose:
+        # a n-ésima data usa o n-ésimo número da lista (ou n, se a lista for menor)
+        doses = []
+        for ordem, (data, laboratorio, lote) in enumerate([
+            ('dataPrimeiraDose', 'codigoLaboratorioPrimeiraDose', 'lotePrimeiraDose'),
+            ('dataSegundaDose', 'codigoLaboratorioSegundaDose', 'loteSegundaDose'),
+        ]):
+            lab_nome = normalizar(df[laboratorio])
+            doses.append(pd.DataFrame({
+                'posicao': np.arange(len(df)),
+                'ordem': ordem,
+                'linha': df.index,
+                'dose_numero': numeros[posicao_numero == ordem].reindex(df.index).fillna(ordem + 1).astype(int),
+                'data_vacinacao': df[data],
+                'lab_id': lab_nome.where(lab_nome != 'NÃO INFORMADO').map(lab_map).astype('Int64'),
+                'lote': texto_opcional(df[lote]),
+            })[validos & df[data].notna()])
+        
+        doses = pd.concat(doses).sort_values(['posicao', 'ordem'], kind='stable').drop(columns=['posicao', 'ordem'])
+        vacinas_erro = self.inserir_por_origem('notificacao_vacina', doses, 'vacina')
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM notificacao_vacina")
-        print(f"✓ Notificação Vacina: {self.cursor.fetchone()[0]} registros ({vacinas_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Notificação Vacina: {registros} registros ({vacinas_erro} erros)")
+        return registros, vacinas_erro
     
-    def migrar_teste_laboratorial(self, notificacao_id_map):
+    def migrar_teste_laboratorial(self, linhas_origem):
         """Migra tabela teste_laboratorial (até 4 testes por notificação)"""
         print("\n--- Migrando TESTE LABORATORIAL ---")
         
@@ -1108,153 +1216,127 @@ class MigradorDadosSUS:
         self.cursor.execute("SELECT fabricante_id, codigo FROM fabricante_teste")
         fab_map = {codigo: id for id, codigo in self.cursor.fetchall()}
         
-        testes_inseridos = 0
-        testes_erro = 0
+        df = self.df
+        com_notificacao = self.com_notificacao(linhas_origem)
         
-        for idx, row in self.df.iterrows():
-            if idx not in notificacao_id_map:
-                continue
-            
-            notificacao_id = notificacao_id_map[idx]
-            
-            # Processar até 4 testes
-            for i in range(1, 5):
-                resultado = int(row[f'codigoResultadoTeste{i}']) if pd.notna(row[f'codigoResultadoTeste{i}']) else None
-                tipo = int(row[f'codigoTipoTeste{i}']) if pd.notna(row[f'codigoTipoTeste{i}']) else None
-                estado = int(row[f'codigoEstadoTeste{i}']) if pd.notna(row[f'codigoEstadoTeste{i}']) else None
-                data_coleta = row[f'dataColetaTeste{i}'] if pd.notna(row[f'dataColetaTeste{i}']) else None
-                
-                fab_codigo = str(row[f'codigoFabricanteTeste{i}']).strip() if pd.notna(row[f'codigoFabricanteTeste{i}']) and str(row[f'codigoFabricanteTeste{i}']).strip().upper() != 'NÃO INFORMADO' else None
-                fabricante_id = fab_map.get(fab_codigo) if fab_codigo else None
-                
-                # Se não tem tipo ou estado, pular
-                if not tipo or not estado:
-                    continue
-                
-                # VALIDAR CONSTRAINT chk_estado_teste:
-                # estado_id = 1: resultado, fabricante e data_coleta devem ser NULL
-                # estado_id = 2: data_coleta deve ser NOT NULL
-                # estado_id = 3: resultado e data_coleta devem ser NOT NULL
-                # estado_id = 4: resultado, fabricante e data_coleta devem ser NULL
-                
-                # Ajustar campos baseado no estado para garantir conformidade
-                if estado == 1:
-                    resultado = None
-                    fabricante_id = None
-                    data_coleta = None
-                elif estado == 2:
-                    if not data_coleta:
-                        # Estado 2 exige data_coleta - pular registro
-                        continue
-                elif estado == 3:
-                    if not resultado or not data_coleta:
-                        # Estado 3 exige resultado e data_coleta - pular registro
-                        continue
-                elif estado == 4:
-                    resultado = None
-                    fabricante_id = None
-                    data_coleta = None
-                
-                try:
-                    self.cursor.execute(
-                        """INSERT INTO teste_laboratorial (notificacao_id, resultado_id, fabricante_id, 
-                           tipo_id, estado_id, data_coleta)
-                           VALUES (%s, %s, %s, %s, %s, %s)""",
-                        (notificacao_id, resultado, fabricante_id, tipo, estado, data_coleta)
-                    )
-                    testes_inseridos += 1
-                except Exception as e:
-                    print(f"  ✗ Erro ao inserir teste (linha {idx}): {e}")
-                    self.conn.rollback()
-                    testes_erro += 1
+        # Processar até 4 testes
+        testes = []
+        for i in range(1, 5):
+            resultado = inteiro_opcional(df[f'codigoResultadoTeste{i}'])
+            tipo = inteiro_opcional(df[f'codigoTipoTeste{i}'])
+            estado = inteiro_opcional(df[f'codigoEstadoTeste{i}']).fillna(0)
+            data_coleta = df[f'dataColetaTeste{i}']
+            fabricante_id = texto_opcional(df[f'codigoFabricanteTeste{i}']).map(fab_map).astype('Int64')
+            
+            # VALIDAR CONSTRAINT chk_estado_teste:
+            # estado_id = 1 ou 4: resultado, fabricante e data_coleta devem ser NULL
+            # estado_id = 2: data_coleta deve ser NOT NULL
+            # estado_id = 3: resultado e data_coleta devem ser NOT NULL
+            sem_detalhes = estado.isin([1, 4])
+            resultado = resultado.mask(sem_detalhes)
+            fabricante_id = fabricante_id.mask(sem_detalhes)
+            data_coleta = data_coleta.mask(sem_detalhes)
+            
+            # Se não tem tipo ou estado, pular; estados 2 e 3 sem os campos exigidos também
+            validos = com_notificacao & (tipo.fillna(0) != 0) & (estado != 0)
+            validos &= ~((estado == 2) & data_coleta.isna())
+            validos &= ~((estado == 3) & ((resultado.fillna(0) == 0) | data_coleta.isna()))
+            
+            testes.append(pd.DataFrame({
+                'posicao': np.arange(len(df)),
+                'teste': i,
+                'linha': df.index,
+                'resultado_id': resultado,
+                'fabricante_id': fabricante_id,
+                'tipo_id': tipo,
+                'estado_id': estado,
+                'data_coleta': data_coleta,
+            })[validos.fillna(False)])
+        
+        testes = pd.concat(testes).sort_values(['posicao', 'teste'], kind='stable').drop(columns=['posicao', 'teste'])
+        testes_erro = self.inserir_por_origem('teste_laboratorial', testes, 'teste')
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM teste_laboratorial")
-        print(f"✓ Testes Laboratoriais: {self.cursor.fetchone()[0]} registros ({testes_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Testes Laboratoriais: {registros} registros ({testes_erro} erros)")
+        return registros, testes_erro
     
-    def migrar_dados_estrategia_local(self, notificacao_id_map):
+    def migrar_dados_estrategia_local(self, linhas_origem):
         """Migra tabela dados_estrategia_local_testagem"""
         print("\n--- Migrando DADOS ESTRATÉGIA/LOCAL TESTAGEM ---")
         
-        dados_inseridos = 0
-        dados_erro = 0
-        
-        for idx, row in self.df.iterrows():
-            if idx not in notificacao_id_map:
-                continue
-            
-            notificacao_id = notificacao_id_map[idx]
-            
-            # Local de testagem (obrigatório)
-            local_testagem_id = int(row['codigoLocalRealizacaoTestagem']) if pd.notna(row['codigoLocalRealizacaoTestagem']) else None
-            if not local_testagem_id:
-                continue
-            
-            # Estratégia (opcional)
-            estrategia_id = int(row['codigoEstrategiaCovid']) if pd.notna(row['codigoEstrategiaCovid']) else None
-            
-            # Especificação outro testagem
-            espec_outro_testagem = str(row['outroLocalRealizacaoTestagem']).strip() if pd.notna(row['outroLocalRealizacaoTestagem']) and str(row['outroLocalRealizacaoTestagem']).strip().upper() != 'NÃO INFORMADO' else None
-            
-            # Código busca ativa
-            codigo_busca_ativa = int(row['codigoBuscaAtivaAssintomatico']) if pd.notna(row['codigoBuscaAtivaAssintomatico']) else None
-            espec_outro_ba = str(row['outroBuscaAtivaAssintomatico']).strip() if pd.notna(row['outroBuscaAtivaAssintomatico']) and str(row['outroBuscaAtivaAssintomatico']).strip().upper() != 'NÃO INFORMADO' else None
-            
-            # Código triagem específica
-            codigo_triagem = int(row['codigoTriagemPopulacaoEspecifica']) if pd.notna(row['codigoTriagemPopulacaoEspecifica']) else None
-            espec_outro_te = str(row['outroTriagemPopulacaoEspecifica']).strip() if pd.notna(row['outroTriagemPopulacaoEspecifica']) and str(row['outroTriagemPopulacaoEspecifica']).strip().upper() != 'NÃO INFORMADO' else None
-            
-            # VALIDAR CONSTRAINTS:
-            # chk_busca_ativa: se estrategia_id != 2, codigo_busca_ativa deve ser NULL
-            if estrategia_id != 2:
-                codigo_busca_ativa = None
-                espec_outro_ba = None
-            
-            # chk_triagem_especifica: se estrategia_id != 3, codigo_triagem deve ser NULL
-            if estrategia_id != 3:
-                codigo_triagem = None
-                espec_outro_te = None
-            
-            # chk_outro_busca_ativa: se codigo_busca_ativa != 4, especificacao_outro_ba deve ser NULL
-            if codigo_busca_ativa != 4:
-                espec_outro_ba = None
-            elif codigo_busca_ativa == 4 and not espec_outro_ba:
-                # Código 4 exige especificação - forçar NULL para evitar erro
-                codigo_busca_ativa = None
-            
-            # chk_outro_triagem_especifica: se codigo_triagem != 5, especificacao_outro_te deve ser NULL
-            if codigo_triagem != 5:
-                espec_outro_te = None
-            elif codigo_triagem == 5 and not espec_outro_te:
-                # Código 5 exige especificação - forçar NULL para evitar erro
-                codigo_triagem = None
-            
-            # chk_outro_testagem: se local_testagem_id != 7, especificacao_outro_testagem deve ser NULL
-            if local_testagem_id != 7:
-                espec_outro_testagem = None
-            elif local_testagem_id == 7 and not espec_outro_testagem:
-                # Local 7 exige especificação - pular registro
-                continue
-            
-            try:
-                self.cursor.execute(
-                    """INSERT INTO dados_estrategia_local_testagem (notificacao_id, local_testagem_id,
-                       especificacao_outro_testagem, estrategia_id, codigo_busca_ativa, codigo_triagem_especifica,
-                       especificacao_outro_ba, especificacao_outro_te)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                       ON CONFLICT (notificacao_id) DO NOTHING""",
-                    (notificacao_id, local_testagem_id, espec_outro_testagem, estrategia_id,
-                     codigo_busca_ativa, codigo_triagem, espec_outro_ba, espec_outro_te)
-                )
-                dados_inseridos += 1
-            except Exception as e:
-                print(f"  ✗ Erro ao inserir estratégia/local (linha {idx}): {e}")
-                self.conn.rollback()
-                dados_erro += 1
+        df = self.df
+        
+        # Local de testagem (obrigatório) e estratégia (opcional)
+        local_testagem_id = inteiro_opcional(df['codigoLocalRealizacaoTestagem'])
+        estrategia_id = inteiro_opcional(df['codigoEstrategiaCovid'])
+        espec_outro_testagem = texto_opcional(df['outroLocalRealizacaoTestagem'])
+        codigo_busca_ativa = inteiro_opcional(df['codigoBuscaAtivaAssintomatico'])
+        espec_outro_ba = texto_opcional(df['outroBuscaAtivaAssintomatico'])
+        codigo_triagem = inteiro_opcional(df['codigoTriagemPopulacaoEspecifica'])
+        espec_outro_te = texto_opcional(df['outroTriagemPopulacaoEspecifica'])
+        
+        # VALIDAR CONSTRAINTS:
+        # chk_busca_ativa: se estrategia_id != 2, codigo_busca_ativa deve ser NULL
+        # chk_triagem_especifica: se estrategia_id != 3, codigo_triagem deve ser NULL
+        estrategia = estrategia_id.fillna(0)
+        codigo_busca_ativa = codigo_busca_ativa.where(estrategia == 2)
+        espec_outro_ba = espec_outro_ba.where(estrategia == 2)
+        codigo_triagem = codigo_triagem.where(estrategia == 3)
+        espec_outro_te = espec_outro_te.where(estrategia == 3)
+        
+        # chk_outro_busca_ativa: se codigo_busca_ativa != 4, especificacao_outro_ba deve ser NULL;
+        # código 4 exige especificação - sem ela, forçar o código para NULL
+        busca_ativa = codigo_busca_ativa.fillna(0)
+        espec_outro_ba = espec_outro_ba.where(busca_ativa == 4)
+        codigo_busca_ativa = codigo_busca_ativa.mask((busca_ativa == 4) & (espec_outro_ba.fillna('') == ''))
+        
+        # chk_outro_triagem_especifica: o mesmo para o código 5
+        triagem = codigo_triagem.fillna(0)
+        espec_outro_te = espec_outro_te.where(triagem == 5)
+        codigo_triagem = codigo_triagem.mask((triagem == 5) & (espec_outro_te.fillna('') == ''))
+        
+        # chk_outro_testagem: se local_testagem_id != 7, especificacao_outro_testagem deve ser NULL;
+        # local 7 exige especificação - sem ela, pular registro
+        local = local_testagem_id.fillna(0)
+        espec_outro_testagem = espec_outro_testagem.where(local == 7)
+        validos = (self.com_notificacao(linhas_origem) & (local != 0)
+                   & ~((local == 7) & (espec_outro_testagem.fillna('') == '')))
+        
+        dados = pd.DataFrame({
+            'linha': df.index,
+            'local_testagem_id': local_testagem_id,
+            'especificacao_outro_testagem': espec_outro_testagem,
+            'estrategia_id': estrategia_id,
+            'codigo_busca_ativa': codigo_busca_ativa,
+            'codigo_triagem_especifica': codigo_triagem,
+            'especificacao_outro_ba': espec_outro_ba,
+            'especificacao_outro_te': espec_outro_te,
+        })[validos.fillna(False)]
+        
+        dados_erro = self.inserir_por_origem(
+            'dados_estrategia_local_testagem', dados, 'estratégia/local',
+            conflito='ON CONFLICT (notificacao_id) DO NOTHING'
+        )
         
-        self.conn.commit()
         self.cursor.execute("SELECT COUNT(*) FROM dados_estrategia_local_testagem")
-        print(f"✓ Dados Estratégia/Local: {self.cursor.fetchone()[0]} registros ({dados_erro} erros)")
+        registros = self.cursor.fetchone()[0]
+        print(f"✓ Dados Estratégia/Local: {registros} registros ({dados_erro} erros)")
+        return registros, dados_erro
+    
+    def executar_carga(self, carga, linhas_origem, dependencias=()):
+        """Roda uma carga da fase 5 em conexão e transação próprias"""
+        for dependencia in dependencias:
+            dependencia.result()
+        
+        migrador = copy.copy(self)  # compartilha o DataFrame, não a conexão
+        migrador.conectar()
+        try:
+            inicio = time.time()
+            registros, erros = getattr(migrador, carga)(linhas_origem)
+            return registros, erros, time.time() - inicio
+        finally:
+            migrador.desconectar()
     
     def executar_migracao_fase5(self):
         """Executa migração da Fase 5: Tabelas dependentes de notificação"""
@@ -1265,26 +1347,35 @@ class MigradorDadosSUS:
         try:
             self.conectar()
             
-            # Criar mapeamentos notificacao_id -> paciente_id e idx -> notificacao_id
-            print("  Criando mapeamentos de notificação...")
-            self.cursor.execute("SELECT notificacao_id, paciente_id FROM notificacao ORDER BY notificacao_id")
-            notificacoes_db = self.cursor.fetchall()
-            
-            # Mapear índice do DataFrame -> notificacao_id (assumindo ordem de inserção)
-            notificacao_id_map = {}
-            notificacao_paciente_map = {}
-            
-            for i, (notif_id, pac_id) in enumerate(notificacoes_db):
-                notificacao_id_map[i] = notif_id
-                notificacao_paciente_map[i] = pac_id
-            
-            self.migrar_residencia_paciente(notificacao_paciente_map)
-            self.migrar_dados_clinicos(notificacao_id_map)
-            self.migrar_notificacao_sintoma(notificacao_id_map)
-            self.migrar_notificacao_condicao(notificacao_id_map)
-            self.migrar_notificacao_vacina(notificacao_id_map)
-            self.migrar_teste_laboratorial(notificacao_id_map)
-            self.migrar_dados_estrategia_local(notificacao_id_map)
+            resultados = {carga: (0, 0, 0.0) for carga, _ in CARGAS_FASE5}
+            for lote in self.lotes():
+                # Recorte sem linhas: não há filhos a migrar
+                if lote.empty:
+                    continue
+                # Linhas do lote que viraram notificação, pela chave gravada na fase 4;
+                # o notificacao_id de cada linha é resolvido por JOIN dentro das cargas
+                self.cursor.execute(
+                    "SELECT linha_origem FROM migracao_origem WHERE linha_origem BETWEEN %s AND %s",
+                    (int(lote.index[0]), int(lote.index[-1]))
+                )
+                linhas_origem = [linha for (linha,) in self.cursor.fetchall()]
+                
+                # A fila do executor segue a ordem de CARGAS_FASE5, então uma carga só
+                # espera por outras que já foram submetidas antes dela
+                with ThreadPoolExecutor(max_workers=WORKERS_FASE5) as executor:
+                    futuros = {}
+                    for carga, dependencias in CARGAS_FASE5:
+                        futuros[carga] = executor.submit(
+                            self.executar_carga, carga, linhas_origem, [futuros[d] for d in dependencias]
+                        )
+                    for carga, futuro in futuros.items():
+                        registros, erros, duracao = futuro.result()
+                        _, erros_antes, duracao_antes = resultados[carga]
+                        resultados[carga] = (registros, erros_antes + erros, duracao_antes + duracao)
+            
+            print("\n  Resumo da fase 5:")
+            for carga, (registros, erros, duracao) in resultados.items():
+                print(f"  {carga.replace('migrar_', ''):<28} {registros:>10} registros {erros:>8} erros {duracao:>8.1f}s")
             
             print("\n" + "="*60)
             print("✓ FASE 5 CONCLUÍDA COM SUCESSO")
@@ -1306,23 +1397,30 @@ class MigradorDadosSUS:
         try:
             self.conectar()
             
+            # Cada fase percorre todos os lotes antes da seguinte: uma notificação
+            # pode usar município/paciente que só aparece em um lote posterior
+            
             # Fase 2
             print("\n" + "="*60)
             print("FASE 2: TABELAS COM DEPENDÊNCIA DE DOMÍNIO")
             print("="*60)
-            self.migrar_municipio()
+            for _ in self.lotes():
+                self.migrar_municipio()
             
             # Fase 3
             print("\n" + "="*60)
             print("FASE 3: ENTIDADES PRINCIPAIS")
             print("="*60)
-            self.migrar_paciente()
+            for _ in self.lotes():
+                self.migrar_paciente()
             
             # Fase 4
             print("\n" + "="*60)
             print("FASE 4: NÚCLEO CENTRAL")
             print("="*60)
-            self.migrar_notificacao()
+            self.preparar_origem()
+            for _ in self.lotes():
+                self.migrar_notificacao()
             
             print("\n" + "="*60)
             print("✓ FASES 2, 3 e 4 CONCLUÍDAS COM SUCESSO")
@@ -1337,7 +1435,7 @@ class MigradorDadosSUS:
 
 
 if __name__ == "__main__":
-    migrador = MigradorDadosSUS('datasus_limpo.parquet', DB_CONFIG)
+    migrador = MigradorDadosSUS('datasus_limpo.parquet', DB_CONFIG, linhas_por_lote=LINHAS_POR_LOTE)
     migrador.executar_migracao_fase1()
     input("\nPressione Enter para iniciar as Fases 2, 3 e 4...")
     migrador.executar_migracao_fase2_3_4()
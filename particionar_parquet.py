@@ -0,0 +1,44 @@
+import os
+import sys
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# particoes no estilo hive (ano_mes=2021-03/estado=PARÁ/...): leitores com
+# filtro em dataNotificacao/estado pulam diretorios inteiros
+COLUNAS_PARTICAO = ['ano_mes', 'estado']
+
+# row groups pequenos e ordenados por municipio/data deixam as estatisticas
+# (min/max) de cada grupo seletivas para filtros nessas colunas
+LINHAS_POR_GRUPO = 20000
+
+
+def particionar(origem, destino, linhas_por_grupo=LINHAS_POR_GRUPO):
+    """Grava o parquet de origem como dataset particionado por ano_mes e estado"""
+    tabela = pq.read_table(origem)
+    ano_mes = pc.strftime(tabela['dataNotificacao'], format='%Y-%m')
+    tabela = tabela.append_column('ano_mes', ano_mes)
+    tabela = tabela.sort_by([
+        ('ano_mes', 'ascending'),
+        ('estado', 'ascending'),
+        ('municipio', 'ascending'),
+        ('dataNotificacao', 'ascending'),
+    ])
+    ds.write_dataset(
+        tabela,
+        destino,
+        format='parquet',
+        partitioning=COLUNAS_PARTICAO,
+        partitioning_flavor='hive',
+        max_rows_per_group=linhas_por_grupo,
+        min_rows_per_group=min(linhas_por_grupo, 1024),
+        existing_data_behavior='delete_matching',
+    )
+    arquivos = ds.dataset(destino, format='parquet', partitioning='hive').files
+    print(f"✓ {tabela.num_rows} linhas gravadas em {len(arquivos)} arquivos em {destino}")
+
+
+if __name__ == "__main__":
+    origem = sys.argv[1] if len(sys.argv) > 1 else 'datasus_limpo.parquet'
+    destino = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(origem)[0]
+    particionar(origem, destino)
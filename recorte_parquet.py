@@ -0,0 +1,30 @@
+import pandas as pd
+
+# filtros de leitura do recorte (periodo, municipios, estados) de um parquet ou
+# de um dataset particionado por particionar_parquet.py; usados pelo dashboard
+# e pelo migracao_db.py, para os dois lerem exatamente as mesmas linhas
+
+
+def filtros_parquet(colunas, inicio=None, fim=None, municipios=None, estados=None):
+    """Filtros no formato de pd.read_parquet/pyarrow: a particao ano_mes poda
+    diretorios e dataNotificacao/municipio/estado usam as estatisticas dos row
+    groups. Colunas ausentes em `colunas` nao entram no filtro"""
+    if colunas is None:
+        return None
+    filtros = []
+    if inicio and 'dataNotificacao' in colunas:
+        inicio = pd.Timestamp(inicio).normalize()
+        filtros.append(('dataNotificacao', '>=', inicio))
+        if 'ano_mes' in colunas:
+            filtros.append(('ano_mes', '>=', inicio.strftime('%Y-%m')))
+    if fim and 'dataNotificacao' in colunas:
+        # o dia final vale inteiro
+        fim = pd.Timestamp(fim).normalize()
+        filtros.append(('dataNotificacao', '<', fim + pd.Timedelta(days=1)))
+        if 'ano_mes' in colunas:
+            filtros.append(('ano_mes', '<=', fim.strftime('%Y-%m')))
+    if municipios and 'municipio' in colunas:
+        filtros.append(('municipio', 'in', list(municipios)))
+    if estados and 'estado' in colunas:
+        filtros.append(('estado', 'in', list(estados)))
+    return filtros or None
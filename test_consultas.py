@@ -0,0 +1,249 @@
+import os
+import sys
+import shutil
+import tempfile
+import importlib.util
+import pandas as pd
+import numpy as np
+
+# confere as consultas otimizadas do dashboard contra o filtro simples em
+# pandas da versao original
+
+data_path = "datasus_limpo.parquet"
+
+CONFIRMADOS = ['CONFIRMADO LABORATORIAL', 'CONFIRMADO POR CRITÉRIO CLÍNICO',
+               'CONFIRMADO CLÍNICO-EPIDEMIOLÓGICO', 'CONFIRMADO CLÍNICO-IMAGEM']
+
+ESTADOS_FILTRO = [
+    ([], '2022-01-01', '2022-12-31'),
+    (None, None, None),
+    (['BELÉM'], '2022-01-01', '2022-12-31'),
+    (['BELÉM', 'ANANINDEUA', 'SANTARÉM'], '2021-03-05', '2022-06-30'),
+    (['MARABÁ'], '2020-01-01', None),
+    (['XYZ'], '2022-01-01', '2022-12-31'),
+]
+
+def preprocess_data(df):
+    df['dataNotificacao'] = pd.to_datetime(df['dataNotificacao'], errors='coerce')
+    df['positivo'] = df['classificacaoFinal'].isin(CONFIRMADOS).astype(int)
+    return df
+
+def filter_dataframe(df, municipios, start_date, end_date):
+    dff = df.copy()
+    if municipios and len(municipios) > 0:
+        dff = dff[dff['municipio'].isin(municipios)]
+    if start_date:
+        dff = dff[dff['dataNotificacao'] >= pd.to_datetime(start_date)]
+    if end_date:
+        # o dashboard considera o dia final inteiro
+        dff = dff[dff['dataNotificacao'] < pd.to_datetime(end_date) + pd.Timedelta(days=1)]
+    return dff
+
+def contar_sintomas(serie):
+    contagem = {}
+    for texto in serie.dropna():
+        texto = str(texto).strip()
+        if not texto or texto.upper() == 'NÃO INFORMADO':
+            continue
+        for sintoma in {s.strip() for s in texto.split(',') if s.strip()}:
+            contagem[sintoma] = contagem.get(sintoma, 0) + 1
+    return contagem
+
+def esperado(dff):
+    datados = dff['dataNotificacao'].dropna()
+    return {
+        'total': len(dff),
+        'confirmados': int(dff['positivo'].sum()),
+        'municipios_afetados': int(dff['municipio'].nunique()),
+        'por_municipio': dff['municipio'].value_counts().to_dict(),
+        'por_sexo': dff['sexo'].value_counts().to_dict(),
+        'por_idade': dff['idade'].dropna().astype(int).value_counts().to_dict(),
+        'sintomas': contar_sintomas(dff['sintomas']),
+        'por_dia': datados.dt.normalize().value_counts().to_dict(),
+        'por_mes': datados.dt.to_period('M').astype(str).value_counts().to_dict(),
+        'por_semana': datados.dt.to_period('W').dt.start_time.dt.strftime('%Y-%m-%d').value_counts().to_dict(),
+        # semana epidemiologica: de domingo a sabado
+        'por_semana_epi': (datados.dt.normalize() - pd.to_timedelta((datados.dt.weekday + 1) % 7, unit='D'))
+                          .dt.strftime('%Y-%m-%d').value_counts().to_dict(),
+    }
+
+def obtido(d, agregados):
+    por_dia = agregados['por_dia']
+    dias = (por_dia['inicio'] + np.arange(len(por_dia['total']))).astype('datetime64[D]')
+    resultado = {
+        'total': agregados['total'],
+        'confirmados': agregados['confirmados'],
+        'municipios_afetados': agregados['municipios_afetados'],
+        'por_municipio': dict(zip(agregados['por_municipio']['municipio'], agregados['por_municipio']['count'])),
+        'por_sexo': dict(zip(agregados['por_sexo']['sexo'], agregados['por_sexo']['count'])),
+        'por_idade': {int(i): int(n) for i, n in agregados['por_idade'].items()},
+        'sintomas': {s: int(n) for s, n in agregados['sintomas'].items() if n > 0},
+        'por_dia': {pd.Timestamp(dia): int(n) for dia, n in zip(dias, por_dia['total']) if n > 0},
+    }
+    for granularidade in ['mes', 'semana', 'semana_epi']:
+        serie = d.agrupar_serie(por_dia, granularidade)
+        serie = serie[serie['total'] > 0]
+        resultado['por_' + granularidade] = dict(zip(serie['periodo'], serie['total'].astype(int)))
+    return resultado
+
+falhas = []
+
+def conferir(nome, valor, referencia):
+    if valor == referencia:
+        print(f"  ✓ {nome}")
+    else:
+        print(f"  ✗ {nome}: {valor} != {referencia}")
+        falhas.append(nome)
+
+def conferir_agregados(rotulo, d, agregados, referencia):
+    valores = obtido(d, agregados)
+    for campo, valor in referencia.items():
+        conferir(f"{rotulo} {campo}", valores[campo], valor)
+
+def carregar_dashboard(nome, **ambiente):
+    # cada carga le as variaveis de ambiente de novo, como um worker novo
+    os.environ.update(ambiente)
+    spec = importlib.util.spec_from_file_location(nome, os.path.join('dashboar', 'dashboard.py'))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nome] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+print("carregando dados...")
+if not os.path.exists(data_path):
+    print("erro: arquivo nao encontrado")
+else:
+    bruto = pd.read_parquet(data_path)
+    base = preprocess_data(bruto.copy())
+    referencias = [esperado(filter_dataframe(base, *estado)) for estado in ESTADOS_FILTRO]
+    print(f"✓ Dataset carregado: {len(base)} linhas")
+
+    temporario = tempfile.mkdtemp(prefix='test_consultas-')
+    try:
+        d = carregar_dashboard('dashboard_completo', DASHBOARD_DADOS=data_path, DASHBOARD_CACHE_DISCO='',
+                               DASHBOARD_BACKEND='pandas', DASHBOARD_MEMORIA_COMPARTILHADA='', DASHBOARD_DIR_DADOS='')
+
+        print("\nTeste 1: cubo de contagens e agregados")
+        for i, (estado, referencia) in enumerate(zip(ESTADOS_FILTRO, referencias)):
+            conferir_agregados(f"filtro {i}", d, d.calcular_agregados(*estado), referencia)
+
+        print("\nTeste 2: periodo por dia inteiro, com horario nos dados e no filtro")
+        # metade das notificacoes a tarde: a fatia por data (linhas dos graficos)
+        # tem que contar as mesmas linhas que o cubo
+        com_horario = bruto.copy()
+        com_horario.loc[1::2, 'dataNotificacao'] += pd.Timedelta(hours=15)
+        arquivo_horario = os.path.join(temporario, 'horario.parquet')
+        com_horario.to_parquet(arquivo_horario)
+        horario = carregar_dashboard('dashboard_horario', DASHBOARD_DADOS=arquivo_horario)
+        for i, estado in enumerate(ESTADOS_FILTRO + [(['BELÉM'], '2022-01-10 12:00', '2022-02-03 08:00'),
+                                                     ([], '2022-03-01 15:00', '2022-03-01 15:00')]):
+            conferir(f"filtro {i} linhas", len(horario.filter_dataframe(*estado, colunas=['municipio'])),
+                     horario.calcular_agregados(*estado)['total'])
+
+        print("\nTeste 3: grade do mapa")
+        # o parquet nao tem coordenadas: pontos sorteados no retangulo do Para
+        sorteio = np.random.default_rng(0)
+        lat = sorteio.uniform(-9.8, 2.6, 5000)
+        lon = sorteio.uniform(-58.9, -46.0, 5000)
+        celulas_anteriores = 0
+        for zoom in [3, 5, 8]:
+            grade = d.agregar_grade(lat, lon, zoom)
+            lado = d.MAPA_RAIO * 360 / (256 * 2 ** zoom)
+            pontos = pd.DataFrame({'linha': np.floor(lat / lado), 'coluna': np.floor(lon / lado)})
+            contagem = pontos.groupby(['linha', 'coluna']).size()
+            conferir(f"zoom {zoom} pontos", int(grade['notificacoes'].sum()), len(lat))
+            conferir(f"zoom {zoom} celulas", sorted(zip(np.floor(grade['latitude'] / lado), np.floor(grade['longitude'] / lado),
+                                                        grade['notificacoes'])),
+                     sorted((l, c, n) for (l, c), n in contagem.items()))
+            conferir(f"zoom {zoom} mais celulas que o anterior", len(grade) > celulas_anteriores, True)
+            celulas_anteriores = len(grade)
+        # arrastar o mapa um pouco nao muda a chave da figura; mudar o zoom muda
+        vista = {'mapbox.center': {'lat': -1.4558, 'lon': -48.5044}, 'mapbox.zoom': 6.2}
+        conferir("vista com arrasto pequeno", d.vista_mapa(vista),
+                 d.vista_mapa({'mapbox.center': {'lat': -1.4601, 'lon': -48.5102}, 'mapbox.zoom': 5.9}))
+        conferir("vista com outro zoom", d.vista_mapa(vista) != d.vista_mapa(dict(vista, **{'mapbox.zoom': 8})), True)
+
+        print("\nTeste 4: memoria compartilhada entre workers")
+        compartilhada = os.path.join(temporario, 'shm')
+        raiz = os.path.join(compartilhada, 'datasus_dashboard')
+        # outro app no mesmo diretorio e uma versao velha deste: so a velha some
+        os.makedirs(os.path.join(compartilhada, 'outro_app'))
+        os.makedirs(os.path.join(raiz, '1-2-v1-0123abcd'))
+        primeiro = carregar_dashboard('dashboard_worker1', DASHBOARD_DADOS=data_path, DASHBOARD_MEMORIA_COMPARTILHADA=compartilhada)
+        versoes = [nome for nome in os.listdir(raiz) if not nome.startswith('.')]
+        conferir("uma versao publicada", len(versoes), 1)
+        conferir("outro app preservado", os.path.isdir(os.path.join(compartilhada, 'outro_app')), True)
+        meta = os.path.join(raiz, versoes[0], 'meta.pkl')
+        publicado_em = os.path.getmtime(meta)
+        segundo = carregar_dashboard('dashboard_worker2', DASHBOARD_MEMORIA_COMPARTILHADA=compartilhada)
+        conferir("segundo worker so mapeia", os.path.getmtime(meta), publicado_em)
+        conferir("indices mapeados somente leitura", isinstance(segundo.indices['datas'], np.memmap)
+                 and not segundo.indices['datas'].flags.writeable, True)
+        for i, (estado, referencia) in enumerate(zip(ESTADOS_FILTRO, referencias)):
+            conferir_agregados(f"filtro {i}", segundo, segundo.calcular_agregados(*estado), referencia)
+        conferir("mesmas linhas nos dois workers", segundo.df.equals(primeiro.df), True)
+        os.environ['DASHBOARD_MEMORIA_COMPARTILHADA'] = ''
+
+        print("\nTeste 5: faixas do histograma de idade")
+        for i, estado in enumerate(ESTADOS_FILTRO):
+            inicio, largura, frequencias = d.faixas_idade(d.calcular_agregados(*estado)['por_idade'], d.HISTOGRAMA_IDADE_FAIXAS)
+            idades = filter_dataframe(base, *estado)['idade'].dropna().astype(int)
+            idades = idades[idades >= 0]
+            conferir(f"filtro {i} no maximo {d.HISTOGRAMA_IDADE_FAIXAS} faixas", len(frequencias) <= d.HISTOGRAMA_IDADE_FAIXAS, True)
+            conferir(f"filtro {i} frequencias", frequencias.tolist(),
+                     np.bincount((idades - inicio) // largura, minlength=len(frequencias)).tolist() if len(idades) else [])
+        # idades de 0 a 199: 40 faixas de 5 anos; idades negativas ficam de fora
+        idades = pd.Series(1, index=np.arange(-3, 200))
+        conferir("faixas largas", d.faixas_idade(idades, 40)[:2] + (len(d.faixas_idade(idades, 40)[2]),), (0, 5, 40))
+        conferir("sem idades", d.faixas_idade(pd.Series(dtype='int64'), 40)[2].tolist(), [])
+
+        print("\nTeste 6: cartoes pelas somas prefixadas")
+        for i, (estado, referencia) in enumerate(zip(ESTADOS_FILTRO, referencias)):
+            indicadores = d._calcular_indicadores(*d.normalizar_filtro(*estado))
+            conferir(f"filtro {i} indicadores", indicadores,
+                     (referencia['total'], referencia['confirmados'], referencia['municipios_afetados']))
+            agregados = horario.calcular_agregados(*estado)
+            conferir(f"filtro {i} indicadores com horario", horario._calcular_indicadores(*horario.normalizar_filtro(*estado)),
+                     (agregados['total'], agregados['confirmados'], agregados['municipios_afetados']))
+
+        print("\nTeste 7: series por periodo e semana epidemiologica")
+        # as series por mes, semana e semana epidemiologica (agrupar_serie) ja
+        # entram em conferir_agregados; aqui os rotulos nas viradas de ano
+        domingos = np.array(['2020-12-27', '2021-01-03', '2022-01-02', '2022-12-25'], dtype='datetime64[D]').astype(np.int64)
+        conferir("rotulos", d.rotulo_semana_epi(domingos), ['SE 53/2020', 'SE 01/2021', 'SE 01/2022', 'SE 52/2022'])
+        valores = np.array([3, 0, 5, 1, 1, 8, 2, 0, 4, 6], dtype=float)
+        conferir("media movel de 7 dias", np.round(d.media_movel_dias(valores, 7), 9).tolist(),
+                 np.round(pd.Series(valores).rolling(7, min_periods=1).mean().to_numpy(), 9).tolist())
+
+        print("\nTeste 8: recarga incremental x carga completa")
+        # metade das linhas (intercaladas, para as datas novas cairem no meio
+        # das antigas) e o arquivo inicial; a outra metade chega no diretorio vigiado
+        novos = os.path.join(temporario, 'novos')
+        os.makedirs(novos)
+        inicial = os.path.join(temporario, 'inicial.parquet')
+        bruto.iloc[::2].reset_index(drop=True).to_parquet(inicial)
+        bruto.iloc[1::2].reset_index(drop=True).to_parquet(os.path.join(novos, 'parte.parquet'))
+        incremental = carregar_dashboard('dashboard_incremental', DASHBOARD_DADOS=inicial)
+        conferir("linhas novas", incremental.recarregar_incremental(novos), len(bruto.iloc[1::2]))
+        conferir("nada novo na segunda verificacao", incremental.recarregar_incremental(novos), 0)
+        for i, (estado, referencia) in enumerate(zip(ESTADOS_FILTRO, referencias)):
+            conferir_agregados(f"filtro {i}", incremental, incremental.calcular_agregados(*estado), referencia)
+            conferir(f"filtro {i} indicadores", incremental._calcular_indicadores(*incremental.normalizar_filtro(*estado)),
+                     d._calcular_indicadores(*d.normalizar_filtro(*estado)))
+            # coluna fora de COLUNAS_GRAFICOS: lida sob demanda das duas fontes
+            racas = incremental.filter_dataframe(*estado, colunas=['racaCor'])['racaCor']
+            conferir(f"filtro {i} coluna sob demanda", racas.astype(object).value_counts().to_dict(),
+                     filter_dataframe(base, *estado)['racaCor'].value_counts().to_dict())
+
+        print("\nTeste 9: backend arrow")
+        arrow = d.ConsultasArrow(data_path, None)
+        conferir("municipios", arrow.municipios(), sorted(base['municipio'].dropna().unique()))
+        for i, (estado, referencia) in enumerate(zip(ESTADOS_FILTRO, referencias)):
+            conferir_agregados(f"filtro {i}", d, arrow.agregados(*d.normalizar_filtro(*estado)), referencia)
+            conferir(f"filtro {i} linhas", len(arrow.linhas(*estado, colunas=['municipio'])), referencia['total'])
+    finally:
+        shutil.rmtree(temporario, ignore_errors=True)
+
+    print("\n" + "=" * 70)
+    print(f"{len(falhas)} falha(s)" if falhas else "✓ todas as consultas conferem com o filtro em pandas")
+    assert not falhas, falhas
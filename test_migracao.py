@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import importlib
+import pandas as pd
+import numpy as np
+from datetime import datetime
+
+import migracao_db
+
+# confere as funcoes puras do migracao_db.py, que nao precisam de banco
+
+falhas = []
+
+def conferir(nome, valor, referencia):
+    if valor == referencia:
+        print(f"  ✓ {nome}")
+    else:
+        print(f"  ✗ {nome}: {valor!r} != {referencia!r}")
+        falhas.append(nome)
+
+print("\nTeste 1: valores no formato texto do COPY")
+conferir("nulo", migracao_db.valor_copy(None), '\\N')
+conferir("data nula", migracao_db.valor_copy(pd.NaT), '\\N')
+# o texto '\N' nao pode virar nulo: a barra e escapada
+conferir("texto \\N", migracao_db.valor_copy('\\N'), '\\\\N')
+conferir("barra invertida", migracao_db.valor_copy('a\\b'), 'a\\\\b')
+conferir("tab, quebras de linha", migracao_db.valor_copy('a\tb\nc\rd'), 'a\\tb\\nc\\rd')
+conferir("booleanos", [migracao_db.valor_copy(v) for v in [True, False, np.bool_(True)]], ['t', 'f', 't'])
+conferir("data", migracao_db.valor_copy(pd.Timestamp('2022-01-18')), '2022-01-18T00:00:00')
+conferir("data python", migracao_db.valor_copy(datetime(2022, 1, 18, 15, 30)), '2022-01-18T15:30:00')
+conferir("numeros", [migracao_db.valor_copy(v) for v in [0, 12, np.int64(7)]], ['0', '12', '7'])
+
+print("\nTeste 2: busca de ids pelas colunas-chave")
+# como no dict da versao linha a linha: idade nula casa com a chave None do
+# banco, e uma chave sem par (ou com sexo/raca nao mapeados) fica nula.
+# o indice e o do lote, que nao comeca em zero no modo streaming
+indice = pd.RangeIndex(100, 105)
+pacientes = {(None, 1, None, False): 5, (30, 1, 2, False): 7, (30, None, 2, True): 9}
+chaves = [pd.Series([np.nan, 30.0, 31.0, 30.0, np.nan], index=indice),
+          pd.Series([1, 1, 1, None, 1], index=indice, dtype='Int64'),
+          pd.Series([None, 2, 2, 2, 2], index=indice, dtype='Int64'),
+          pd.Series([False, False, False, True, False], index=indice, dtype=object)]
+ids = migracao_db.buscar_ids(chaves, pacientes)
+conferir("ids", ids.astype(object).where(ids.notna(), None).tolist(), [5, 7, None, 9, None])
+conferir("indice do lote", list(ids.index), list(indice))
+vazio = migracao_db.buscar_ids([pd.Series(['BELÉM'], index=[7]), pd.Series(['PARÁ'], index=[7])], {})
+conferir("cache vazio", (vazio.isna().tolist(), list(vazio.index)), ([True], [7]))
+
+print("\nTeste 3: workers da fase 5")
+for valor, esperado in [('0', 1), ('-2', 1), ('3', 3)]:
+    os.environ['MIGRACAO_WORKERS'] = valor
+    conferir(f"MIGRACAO_WORKERS={valor}", importlib.reload(migracao_db).WORKERS_FASE5, esperado)
+del os.environ['MIGRACAO_WORKERS']
+importlib.reload(migracao_db)
+
+print("\nTeste 4: leitura em lotes")
+# row groups de 3.000 linhas e lotes de 5.000: os lotes juntam e partem row
+# groups, e juntos tem que dar a leitura inteira do mesmo recorte
+temporario = tempfile.mkdtemp(prefix='test_migracao-')
+try:
+    arquivo = os.path.join(temporario, 'lotes.parquet')
+    pd.DataFrame({
+        'dataNotificacao': pd.date_range('2022-01-01', periods=22000, freq='h'),
+        'municipio': np.where(np.arange(22000) % 3, 'BELÉM', 'MARABÁ'),
+        'idade': np.arange(22000) % 90,
+    }).to_parquet(arquivo, row_group_size=3000)
+    for recorte in [(), ('2022-01-20', '2023-06-30'), ('2022-02-01', '2022-05-31', ['MARABÁ'])]:
+        inteiro = migracao_db.ler_parquet(arquivo, *recorte)
+        lotes = list(migracao_db.ler_lotes(arquivo, 5000, *recorte))
+        tamanhos = [len(lote) for lote in lotes]
+        conferir(f"recorte {recorte} lotes cheios", all(t == 5000 for t in tamanhos[:-1]) and 0 < tamanhos[-1] <= 5000, True)
+        conferir(f"recorte {recorte} linhas", sum(tamanhos), len(inteiro))
+        juntos = pd.concat(lotes)
+        conferir(f"recorte {recorte} indice continuo", juntos.index.equals(pd.RangeIndex(len(inteiro))), True)
+        conferir(f"recorte {recorte} mesmos dados", juntos.equals(inteiro), True)
+finally:
+    shutil.rmtree(temporario, ignore_errors=True)
+
+print("\n" + "=" * 70)
+print(f"{len(falhas)} falha(s)" if falhas else "✓ todas as funcoes do migrador conferem")
+assert not falhas, falhas